@@ -0,0 +1,126 @@
+"""Model calls and Telegram messages needed to learn from a 10-screenshot album.
+
+Sends the same album once photo by photo through process_conversation, as before
+albums were batched, and once through the media-group path, then counts requests
+to a local fake OpenAI server, embedding batches, index saves and bot replies.
+
+    python benchmarks/bench_album.py --photos 10 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import io
+import time
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from PIL import Image
+
+from bench_concurrency import load_bot
+from fake_openai import FakeOpenAI
+from fake_telegram import FakeContext, FakeMessage, FakePhoto, FakeUpdate
+
+
+# Fake embedding model that counts the batches it is asked for
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.model = DeterministicFakeEmbedding(size=384)
+        self.batches = 0
+        self.texts = 0
+
+    def embed_documents(self, texts):
+        self.batches += 1
+        self.texts += len(texts)
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def screenshot(seed: int) -> bytes:
+    pixels = np.random.default_rng(seed).integers(0, 255, (1600, 740, 3), np.uint8)
+    buffered = io.BytesIO()
+    Image.fromarray(pixels).save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+
+# One album as Telegram delivers it: only the first photo carries the caption
+def album(user_id: int, photos: int, sent: list, media_group_id=None):
+    return [
+        FakeUpdate(
+            FakeMessage(
+                sent,
+                user_id,
+                photo=FakePhoto(
+                    f"{user_id}-{index}", screenshot(user_id * 1000 + index)
+                ),
+                caption="learn" if index == 0 or media_group_id is None else None,
+                media_group_id=media_group_id,
+            )
+        )
+        for index in range(photos)
+    ]
+
+
+async def wait_until_idle(bot) -> None:
+    while (
+        bot.album_tasks
+        or bot.running_users
+        or any(bot.user_queues.values())
+        or bot.scheduler_stats["queue_depth"]
+    ):
+        await asyncio.sleep(0.05)
+
+
+async def main(photos: int, latency: float) -> None:
+    server = FakeOpenAI(latency=latency).start()
+    bot = load_bot(server)
+    counting = CountingEmbeddings()
+    bot.embeddings.embeddings = counting
+    saves = []
+    save_style_index = bot.save_style_index
+
+    def counted_save(user_id, vector_store):
+        saves.append(user_id)
+        save_style_index(user_id, vector_store)
+
+    bot.save_style_index = counted_save
+    await bot.start_scheduler(None)
+
+    async def photo_by_photo(user_id: int, sent: list) -> None:
+        for update in album(user_id, photos, sent):
+            await bot.process_conversation(update, FakeContext())
+
+    async def media_group(user_id: int, sent: list) -> None:
+        for update in album(user_id, photos, sent, media_group_id=f"album-{user_id}"):
+            await bot.collect_album_photo(update, FakeContext())
+        await wait_until_idle(bot)
+
+    print(f"{photos}-screenshot album, fake model latency {latency:.2f} s per call")
+    print(
+        f"{'path':>14} {'vision':>6} {'chat':>4} {'embed batches':>13} "
+        f"{'saves':>5} {'replies':>7} {'wall s':>7}"
+    )
+    for user_id, (name, flow) in enumerate(
+        [("photo by photo", photo_by_photo), ("album", media_group)], start=1
+    ):
+        server.reset()
+        counting.batches = 0
+        saves.clear()
+        sent = []
+        started = time.perf_counter()
+        await flow(user_id, sent)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{name:>14} {server.counts['vision']:>6} {server.counts['chat']:>4} "
+            f"{counting.batches:>13} {len(saves):>5} {len(sent):>7} "
+            f"{elapsed:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--photos", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(main(args.photos, args.latency))
@@ -0,0 +1,132 @@
+"""Import time, peak memory and wall time of extracting a video's audio track.
+
+Compares the old moviepy path, which loaded the clip with VideoFileClip and wrote
+a full PCM WAV next to the video, with extract_audio, which demuxes the track
+into 16 kHz Opus through an ffmpeg pipe. Each path runs in a fresh process with
+the bot already imported, so only its own cost is counted. Peak memory covers
+the ffmpeg processes too, sampled every 10 ms. Needs ffmpeg on PATH, moviepy
+installed and Linux, since memory is read from /proc.
+
+    python benchmarks/bench_audio.py --clips 30,120 --size 1280x720
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from bench_concurrency import load_bot, rss_mb
+from synthetic_video import make_clip
+
+
+# Resident memory of this process plus the ffmpeg processes it started, in MB
+def tree_rss_mb() -> float:
+    total = rss_mb()
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                fields = dict(line.split(":", 1) for line in status)
+        except OSError:
+            continue  # Exited while we were looking
+        if int(fields["PPid"]) == os.getpid() and "VmRSS" in fields:
+            total += int(fields["VmRSS"].split()[0]) / 1024
+    return total
+
+
+# Sample the memory of the process tree until stopped, keeping the peak
+class PeakSampler(threading.Thread):
+    def __init__(self, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = tree_rss_mb()
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, tree_rss_mb())
+
+
+# What transcribe_video_audio did before, minus the transcription
+def extract_with_moviepy(video_path: str) -> bytes:
+    from moviepy import VideoFileClip
+
+    video_clip = VideoFileClip(video_path)
+    audio_path = video_path.replace(".mp4", ".wav")
+    video_clip.audio.write_audiofile(audio_path, logger=None)
+    video_clip.close()
+    try:
+        with open(audio_path, "rb") as audio_file:
+            return audio_file.read()
+    finally:
+        os.remove(audio_path)
+
+
+# Run one path in this process and report its numbers as JSON
+def extract(path: str, video_path: str) -> None:
+    bot = load_bot()
+    import_started = time.perf_counter()
+    if path == "moviepy":
+        from moviepy import VideoFileClip  # noqa: F401
+    import_time = time.perf_counter() - import_started
+
+    rss_before = tree_rss_mb()
+    sampler = PeakSampler()
+    sampler.start()
+    started = time.perf_counter()
+    if path == "moviepy":
+        audio = extract_with_moviepy(video_path)
+    else:
+        audio = asyncio.run(bot.extract_audio(video_path))
+    elapsed = time.perf_counter() - started
+    sampler.stopped.set()
+    sampler.join()
+    print(
+        json.dumps(
+            {
+                "import_s": import_time,
+                "peak_mb": sampler.peak - rss_before,
+                "wall_s": elapsed,
+                "audio_kb": len(audio) / 1024,
+            }
+        )
+    )
+
+
+def main(clips, width: int, height: int) -> None:
+    print(f"Clips at {width}x{height}, 30 fps, with a 440 Hz tone")
+    print(
+        f"{'clip s':>6} {'path':>8} {'import s':>8} {'peak MB':>7} "
+        f"{'wall s':>6} {'audio KB':>8}"
+    )
+    for seconds in clips:
+        video_path = make_clip(seconds, width, height)
+        for path in ("moviepy", "ffmpeg"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--extract", path, video_path],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{seconds:>6} {path:>8} {result['import_s']:>8.2f} "
+                f"{result['peak_mb']:>7.1f} {result['wall_s']:>6.2f} "
+                f"{result['audio_kb']:>8.0f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clips", default="30,120")
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--extract", nargs=2, metavar=("PATH", "VIDEO"))
+    args = parser.parse_args()
+    if args.extract:
+        extract(*args.extract)
+    else:
+        width, height = (int(n) for n in args.size.split("x"))
+        main([int(n) for n in args.clips.split(",")], width, height)
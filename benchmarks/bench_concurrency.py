@@ -0,0 +1,80 @@
+"""Concurrent-user throughput of the chat path against a local fake OpenAI server.
+
+Compares the async path the bot uses (generate_response, which awaits ainvoke)
+with a handler that calls the model synchronously, as the bot did before.
+
+    python benchmarks/bench_concurrency.py --latency 0.5 --users 1,5,10,20
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from fake_openai import FakeOpenAI
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Import the bot against the fake server, if any, with its state in a temp dir
+def load_bot(server: Optional[FakeOpenAI] = None):
+    os.environ["OPENAI_API_KEY"] = "bench"
+    if server is not None:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["EMBEDDINGS_PROVIDER"] = "fake"
+    os.chdir(tempfile.mkdtemp(prefix="rizzard-bench-"))
+    sys.path.insert(0, REPO_DIR)
+    import bot
+
+    return bot
+
+
+# Resident memory of this process in MB, read from /proc so it needs Linux
+def rss_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def run_users(bot, mode: str, users: int) -> float:
+    async def async_handler(user_id: int) -> None:
+        await bot.generate_response(user_id, "She replied 'maybe', what now?")
+
+    # What every handler did before: a synchronous round trip on the event loop
+    async def blocking_handler(user_id: int) -> None:
+        bot.model.invoke([bot.HumanMessage(content="She replied 'maybe', what now?")])
+
+    handler = async_handler if mode == "async" else blocking_handler
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(user_id) for user_id in range(users)))
+    return time.perf_counter() - started
+
+
+async def main(latency: float, user_counts) -> None:
+    server = FakeOpenAI(latency=latency).start()
+    bot = load_bot(server)
+
+    print(f"Fake LLM latency: {latency:.2f} s per call")
+    print(f"{'mode':>8} {'users':>5} {'wall s':>7} {'replies/s':>9} {'overlap':>7}")
+    for mode in ("blocking", "async"):
+        await run_users(bot, mode, 1)  # Warm up connections and history tables
+        for users in user_counts:
+            server.reset()
+            elapsed = await run_users(bot, mode, users)
+            print(
+                f"{mode:>8} {users:>5} {elapsed:>7.2f} {users / elapsed:>9.1f} "
+                f"{server.max_in_flight:>7}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--users", default="1,5,10,20")
+    args = parser.parse_args()
+    asyncio.run(main(args.latency, [int(n) for n in args.users.split(",")]))
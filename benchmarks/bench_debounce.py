@@ -0,0 +1,112 @@
+"""LLM calls per 1k bursty messages with the adaptive debounce in handle_message.
+
+Simulated users type bursts of short messages at their own pace, then pause.
+Each message goes through handle_message. answer_messages is replaced by a
+counter, so no model is called. Time runs faster than the wall clock by 1/scale.
+
+    python benchmarks/bench_debounce.py --messages 1000 --users 20
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from bench_concurrency import load_bot
+from fake_telegram import FakeContext, FakeMessage, FakeUpdate
+
+
+# The bot's clock and sleeps, running 1/scale times faster than real time
+class ScaledTime:
+    def __init__(self, scale: float):
+        self.scale = scale
+        self.started = time.monotonic()
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def monotonic(self) -> float:
+        return (time.monotonic() - self.started) / self.scale
+
+    async def sleep(self, delay: float) -> None:
+        await asyncio.sleep(delay * self.scale)
+
+
+# Gaps between one user's messages: quick bursts at the user's pace, then a pause
+def message_gaps(rng: random.Random, count: int):
+    pace = rng.uniform(0.8, 3.0)  # Mean seconds between messages of a burst
+    gaps = []
+    while len(gaps) < count:
+        burst = min(rng.randint(1, 6), count - len(gaps))
+        gaps.append(rng.uniform(30, 120))
+        gaps.extend(rng.expovariate(1 / pace) for _ in range(burst - 1))
+    return gaps
+
+
+async def main(messages: int, users: int, scale: float, seed: int) -> None:
+    bot = load_bot()
+    clock = ScaledTime(scale)
+    bot.time = clock
+    bot.sleep = clock.sleep
+    await bot.start_scheduler(None)
+
+    calls = []  # (messages in the call, seconds since the user's last message)
+    last_sent = {}
+    bursts = 0
+
+    async def answer_messages(update, context, user_message: str) -> None:
+        user_id = update.message.from_user.id
+        waited = clock.monotonic() - last_sent[user_id]
+        calls.append((user_message.count("\n") + 1, waited))
+
+    bot.answer_messages = answer_messages
+    rng = random.Random(seed)
+
+    async def user(user_id: int, count: int) -> None:
+        nonlocal bursts
+        context = FakeContext()
+        for index, gap in enumerate(message_gaps(rng, count)):
+            bursts += gap >= 30  # Pauses are 30 s or more, in-burst gaps far less
+            await clock.sleep(gap)
+            last_sent[user_id] = clock.monotonic()
+            update = FakeUpdate(FakeMessage([], user_id, text=f"message {index}"))
+            await bot.handle_message(update, context)
+
+    counts = [messages // users + (i < messages % users) for i in range(users)]
+    await asyncio.gather(
+        *(user(user_id, count) for user_id, count in enumerate(counts))
+    )
+    await clock.sleep(bot.DEBOUNCE_MAX_WAIT + 1)
+    while bot.running_users or any(bot.user_queues.values()):
+        await asyncio.sleep(0.01)
+
+    delivered = sum(size for size, _ in calls)
+    waits = [waited for _, waited in calls]
+    print(f"{messages} messages from {users} users, seed {seed}")
+    print(
+        f"LLM calls: {len(calls)} ({1000 * len(calls) / messages:.0f} per 1k messages)"
+    )
+    print(
+        f"Calls saved per 1k messages: {1000 * (messages - len(calls)) / messages:.0f}"
+    )
+    print(f"Bursts typed: {bursts}, the fewest calls possible")
+    print(f"Messages answered: {delivered} of {messages}")
+    print(
+        f"Messages per call: mean {delivered / len(calls):.2f}, "
+        f"max {max(size for size, _ in calls)}"
+    )
+    print(
+        f"Wait after the last message: mean {statistics.mean(waits):.2f} s, "
+        f"max {max(waits):.2f} s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--scale", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main(args.messages, args.users, args.scale, args.seed))
@@ -0,0 +1,75 @@
+"""Wall time of describing a video's frames versus clip length.
+
+Frames are sampled once per clip, then described one after another, as
+extract_frames_from_video did before, and through extract_frames_from_video,
+which describes them concurrently under the per-user and global limits. A second
+user sends a single photo while the long clip is being described, to show that
+the per-user limit leaves vision slots for others. Everything runs against a
+local fake vision endpoint. Needs ffmpeg on PATH.
+
+    python benchmarks/bench_frames.py --clips 10,30,60,120 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import time
+
+from bench_concurrency import load_bot
+from fake_openai import FakeOpenAI
+from synthetic_video import make_clip
+
+
+async def main(clips, latency: float) -> None:
+    server = FakeOpenAI(latency=latency).start()
+    bot = load_bot(server)
+    bot.vision_cache.get = lambda key: None  # Every frame pays for its vision call
+
+    print(f"Fake vision latency: {latency:.2f} s per call")
+    print(
+        f"Limits: {bot.VISION_USER_CONCURRENCY} per user, "
+        f"{bot.VISION_GLOBAL_CONCURRENCY} overall"
+    )
+    print(
+        f"{'clip s':>6} {'frames':>6} {'sequential s':>12} {'concurrent s':>12} "
+        f"{'speedup':>7} {'overlap':>7} {'other user s':>12}"
+    )
+    for seconds in clips:
+        path = make_clip(seconds, audio=False)
+        _, images = await asyncio.get_running_loop().run_in_executor(
+            bot.video_process_pool, bot.sample_distinct_frames, path
+        )
+
+        started = time.perf_counter()
+        for image in images:
+            await bot.describe_image(image)
+        sequential = time.perf_counter() - started
+
+        async def long_video() -> None:
+            async for _ in bot.extract_frames_from_video(path, user_id=1):
+                pass
+
+        # Another user's photo arrives just after the long clip started
+        async def other_user() -> float:
+            await asyncio.sleep(latency / 10)
+            started = time.perf_counter()
+            await bot.describe_frame(2, images[0])
+            return time.perf_counter() - started
+
+        server.reset()
+        started = time.perf_counter()
+        _, other = await asyncio.gather(long_video(), other_user())
+        # Sampling runs again inside extract_frames_from_video, as it does for real
+        concurrent = time.perf_counter() - started
+        print(
+            f"{seconds:>6} {len(images):>6} {sequential:>12.2f} {concurrent:>12.2f} "
+            f"{sequential / concurrent:>6.1f}x {server.max_in_flight:>7} "
+            f"{other:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clips", default="10,30,60,120")
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(main([int(n) for n in args.clips.split(",")], args.latency))
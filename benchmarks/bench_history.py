@@ -0,0 +1,111 @@
+"""Memory footprint of the chat history store at 100k simulated users.
+
+Every user has a few turns, added through get_session_history as
+RunnableWithMessageHistory does. The old store, which kept an
+InMemoryChatMessageHistory per user forever, is compared with the SQLite store
+that keeps MAX_CACHED_SESSIONS sessions in RAM. Each store is filled in a fresh
+process so their resident memory does not mix. Linux only, RSS comes from /proc.
+
+    python benchmarks/bench_history.py --users 100000 --turns 3
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
+
+from bench_concurrency import load_bot, rss_mb
+
+
+def turn(user_id: int, index: int):
+    return [
+        HumanMessage(
+            content=f"User {user_id} asks: she said maybe, what now? #{index}"
+        ),
+        AIMessage(content="Keep it light, you should say: no pressure, maybe works!"),
+    ]
+
+
+# Fill one store in this process and report its numbers as JSON
+def fill(backend: str, users: int, turns: int) -> None:
+    bot = load_bot()
+    if backend == "memory":
+        # What get_session_history did before: one history per user, kept forever
+        store = {}
+
+        def get_session_history(session_id: str):
+            if session_id not in store:
+                store[session_id] = InMemoryChatMessageHistory()
+            return store[session_id]
+
+    else:
+        get_session_history = bot.get_session_history
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    for index in range(turns):
+        for user_id in range(users):
+            get_session_history(str(user_id)).add_messages(turn(user_id, index))
+    elapsed = time.perf_counter() - started
+
+    # First message from a user whose session was evicted long ago
+    cold_started = time.perf_counter()
+    messages = get_session_history("0").messages
+    cold = time.perf_counter() - cold_started
+
+    disk = os.path.getsize(bot.HISTORY_DB_PATH) if backend == "sqlite" else 0
+    wal = bot.HISTORY_DB_PATH + "-wal"
+    if backend == "sqlite" and os.path.exists(wal):
+        disk += os.path.getsize(wal)
+    print(
+        json.dumps(
+            {
+                "rss": rss_mb() - rss_before,
+                "disk": disk / 1024 / 1024,
+                "per_turn_us": 1e6 * elapsed / (users * turns),
+                "cold_ms": 1000 * cold,
+                "messages": len(messages),
+                "resident": len(store) if backend == "memory" else len(bot.store),
+            }
+        )
+    )
+
+
+def main(users: int, turns: int) -> None:
+    print(f"{users} users, {turns} turns each")
+    print(
+        f"{'store':>7} {'RSS MB':>7} {'disk MB':>7} {'us/turn':>7} "
+        f"{'cold ms':>7} {'resident':>8}"
+    )
+    for backend in ("memory", "sqlite"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--fill", backend]
+            + ["--users", str(users), "--turns", str(turns)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        assert result["messages"] == min(2 * turns, 50), result
+        print(
+            f"{backend:>7} {result['rss']:>7.1f} {result['disk']:>7.1f} "
+            f"{result['per_turn_us']:>7.0f} {result['cold_ms']:>7.2f} "
+            f"{result['resident']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--fill", choices=["memory", "sqlite"])
+    args = parser.parse_args()
+    if args.fill:
+        fill(args.fill, args.users, args.turns)
+    else:
+        main(args.users, args.turns)
@@ -0,0 +1,76 @@
+"""Per-message overhead of wrapping the chain in RunnableWithMessageHistory.
+
+Compares building a RunnableWithMessageHistory around a closure for every
+message, as the handlers did before, with the single chain_with_history that
+resolves histories by session_id. The model is a local fake that answers
+instantly, so only the wrapping, history and prompt work is timed.
+
+    python benchmarks/bench_history_runnable.py --messages 2000 --users 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables.history import RunnableWithMessageHistory
+
+from bench_concurrency import load_bot
+
+
+async def main(messages: int, users: int) -> None:
+    bot = load_bot()
+    fake_model = FakeListChatModel(responses=["Keep it light, ask about her weekend."])
+    chain = (
+        RunnableLambda(bot.compact_history)
+        | RunnableLambda(bot.add_style_context)
+        | bot.prompt
+        | fake_model
+    )
+    shared = RunnableWithMessageHistory(chain, bot.get_session_history)
+
+    # What process_message_with_delay and generate_response did for every message
+    async def per_message(user_id: str, config: dict):
+        session_history = bot.get_session_history(user_id)
+        with_message_history = RunnableWithMessageHistory(
+            chain, lambda: session_history
+        )
+        return await with_message_history.ainvoke(
+            [bot.HumanMessage(content="She said maybe, what now?")], config=config
+        )
+
+    async def reused(user_id: str, config: dict):
+        return await shared.ainvoke(
+            [bot.HumanMessage(content="She said maybe, what now?")], config=config
+        )
+
+    print(f"{messages} messages from {users} users, fake model")
+    print(f"{'runnable':>12} {'mean us':>8} {'p50 us':>8} {'build us':>8}")
+    for name, handler in (("per message", per_message), ("shared", reused)):
+        timings = []
+        for index in range(messages):
+            user_id = f"{name}-{index % users}"
+            config = {"configurable": {"session_id": user_id}}
+            started = time.perf_counter()
+            await handler(user_id, config)
+            timings.append(time.perf_counter() - started)
+
+        # The wrapper construction alone, which the shared runnable pays once
+        started = time.perf_counter()
+        for _ in range(messages if name == "per message" else 0):
+            RunnableWithMessageHistory(chain, lambda: None)
+        build = (time.perf_counter() - started) / messages
+        print(
+            f"{name:>12} {1e6 * statistics.mean(timings):>8.0f} "
+            f"{1e6 * statistics.median(timings):>8.0f} {1e6 * build:>8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.messages, args.users))
@@ -0,0 +1,88 @@
+"""Bytes uploaded and milliseconds spent encoding each image sent to the vision model.
+
+Compares the old path, which saved the full-size image to a temp file and read it
+back to base64 it, with encode_image_from_pil at the detail level each caller
+uses. Images are generated: a phone photo, a chat screenshot and a video frame.
+
+    python benchmarks/bench_images.py --repeat 10
+"""
+
+import argparse
+import base64
+import os
+import statistics
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+from bench_concurrency import load_bot
+
+
+def photo(width: int, height: int) -> Image.Image:
+    extent = (-2.0, -1.2, 0.8, 1.2)
+    return Image.effect_mandelbrot((width, height), extent, 100).convert("RGB")
+
+
+# Chat bubbles of text on a plain background, like the screenshots users send
+def screenshot(width: int = 1170, height: int = 2532) -> Image.Image:
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for row, top in enumerate(range(200, height - 200, 160)):
+        left = 40 if row % 2 else width // 3
+        draw.rounded_rectangle(
+            (left, top, left + width * 2 // 3 - 40, top + 120),
+            30,
+            fill="#e5e5ea" if row % 2 else "#0b84ff",
+        )
+        draw.text((left + 30, top + 40), f"message number {row} " * 3, fill="black")
+    return image
+
+
+# What describe_image did before: a full-size JPEG through a temp file
+def encode_through_temp_file(image: Image.Image) -> str:
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp_file:
+        image.save(tmp_file, format="JPEG")
+        image_path = tmp_file.name
+    with open(image_path, "rb") as image_file:
+        encoded = base64.b64encode(image_file.read()).decode("utf-8")
+    os.remove(image_path)  # The bot never did, the files piled up in /tmp
+    return encoded
+
+
+def measure(encode, image: Image.Image, repeat: int) -> tuple:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encoded = encode(image)
+        timings.append(time.perf_counter() - started)
+    return len(encoded), 1000 * statistics.median(timings)
+
+
+def main(repeat: int) -> None:
+    bot = load_bot()
+    images = {
+        "photo 3024x4032": (photo(3024, 4032), "low"),
+        "screenshot 1170x2532": (screenshot(), "high"),
+        "frame 1920x1080": (photo(1920, 1080), "low"),
+    }
+
+    print(f"Median of {repeat} runs, JPEG quality {bot.JPEG_QUALITY}")
+    print(f"{'image':>20} {'path':>14} {'KB':>7} {'ms':>7}")
+    for name, (image, detail) in images.items():
+        paths = {
+            "temp file": encode_through_temp_file,
+            f"memory, {detail}": lambda image: bot.encode_image_from_pil(
+                image, detail=detail
+            ),
+        }
+        for path, encode in paths.items():
+            size, ms = measure(encode, image, repeat)
+            print(f"{name:>20} {path:>14} {size / 1024:>7.1f} {ms:>7.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    main(args.repeat)
@@ -0,0 +1,84 @@
+"""CPU time of video frame sampling on synthetic clips at several resolutions.
+
+Compares the old sampler, which decoded every frame with cap.read() and kept one
+per interval, with sample_video_frames in each of its modes. Everything runs in
+this process, so process time counts OpenCV's decoder threads too. Needs ffmpeg
+on PATH to make the clips.
+
+    python benchmarks/bench_sampling.py --seconds 30 --keyframe-interval 30
+"""
+
+import argparse
+import time
+from typing import Optional
+
+import cv2
+
+from bench_concurrency import load_bot
+from synthetic_video import make_clip
+
+
+# What extract_frames_from_video did before: decode everything, keep one per second
+def decode_every_frame(bot, video_path: str):
+    cap = cv2.VideoCapture(video_path)
+    frame_interval = int(cap.get(cv2.CAP_PROP_FPS))
+    images = []
+    index = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if index % frame_interval == 0:
+            images.append(bot.frame_to_image(frame))
+        index += 1
+    cap.release()
+    return images
+
+
+def measure(sample) -> tuple:
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    images = sample()
+    return (
+        len(images),
+        time.process_time() - cpu_started,
+        time.perf_counter() - wall_started,
+    )
+
+
+def main(seconds: int, sizes, keyframe_interval: Optional[int]) -> None:
+    bot = load_bot()
+    samplers = {
+        "decode all": lambda path: decode_every_frame(bot, path),
+        "fps": lambda path: bot.sample_video_frames(path, mode="fps"),
+        "max_frames": lambda path: bot.sample_video_frames(
+            path, mode="max_frames", max_frames=10
+        ),
+        "scene": lambda path: bot.sample_video_frames(path, mode="scene"),
+    }
+
+    print(
+        f"{seconds} s clips at 30 fps, keyframe every "
+        f"{keyframe_interval or 250} frames"
+    )
+    print(f"{'size':>9} {'sampler':>10} {'frames':>6} {'cpu s':>6} {'wall s':>6}")
+    for width, height in sizes:
+        path = make_clip(seconds, width, height, False, keyframe_interval)
+        for name, sample in samplers.items():
+            frames, cpu, wall = measure(lambda: sample(path))
+            print(
+                f"{width:>4}x{height:<4} {name:>10} {frames:>6} {cpu:>6.2f} {wall:>6.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=int, default=30)
+    parser.add_argument("--sizes", default="640x360,1280x720,1920x1080")
+    parser.add_argument("--keyframe-interval", type=int)
+    args = parser.parse_args()
+    main(
+        args.seconds,
+        [tuple(int(n) for n in size.split("x")) for size in args.sizes.split(",")],
+        args.keyframe_interval,
+    )
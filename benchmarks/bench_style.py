@@ -0,0 +1,56 @@
+"""A/B latency of the style modes for a user who taught the bot their style.
+
+Answers the same messages in STYLE_MODE=rewrite (reply, then a second call to
+restyle the suggestion) and STYLE_MODE=inline (style in the main call), against
+a local fake OpenAI server, and reports latency and chat calls per reply.
+
+    python benchmarks/bench_style.py --turns 20 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from bench_concurrency import load_bot
+from fake_openai import OCR_REPLY, FakeOpenAI
+from fake_telegram import FakeContext, FakeMessage, FakeUpdate
+
+
+async def main(turns: int, latency: float) -> None:
+    server = FakeOpenAI(latency=latency).start()
+    bot = load_bot(server)
+
+    print(f"Fake LLM latency: {latency:.2f} s per call, {turns} replies per mode")
+    print(f"{'mode':>8} {'mean s':>7} {'p95 s':>7} {'chat calls/reply':>16}")
+    for user_id, mode in enumerate(("rewrite", "inline"), start=1):
+        bot.STYLE_MODE = mode
+        await bot.add_to_style_index(user_id, OCR_REPLY.splitlines())
+        bot.learn_style_profile(user_id, OCR_REPLY)
+
+        async def answer() -> float:
+            sent = []
+            update = FakeUpdate(FakeMessage(sent, user_id, text="She said maybe"))
+            started = time.perf_counter()
+            await bot.answer_messages(update, FakeContext(), "She said maybe")
+            return time.perf_counter() - started
+
+        # The first inline turn writes the style digest in the background
+        await answer()
+        await asyncio.gather(*bot.digest_tasks.values())
+
+        server.reset()
+        latencies = [await answer() for _ in range(turns)]
+        p95 = statistics.quantiles(latencies, n=20)[-1]
+        print(
+            f"{mode:>8} {statistics.mean(latencies):>7.2f} {p95:>7.2f} "
+            f"{server.counts['chat'] / turns:>16.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(main(args.turns, args.latency))
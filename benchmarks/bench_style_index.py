@@ -0,0 +1,124 @@
+"""Resident memory and warm/cold latency of the per-user style indexes at 10k users.
+
+Builds one on-disk style index per user, then touches every user once through
+get_style_index, as their next messages would. This is measured with the
+resident cap (MAX_RESIDENT_STYLE_INDEXES) and without one, which is how every
+index stayed in RAM before. Each run is a fresh process, so startup loads
+nothing and embeds nothing. Vectors are random, with OpenAI's 1536 dimensions by
+default. Linux only, RSS comes from /proc.
+
+    python benchmarks/bench_style_index.py --users 10000 --chunks 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from bench_concurrency import load_bot, rss_mb
+
+
+def build(bot, users: int, chunks: int, dims: int) -> None:
+    rng = np.random.default_rng(0)
+    for user_id in range(users):
+        texts = [
+            f"user {user_id} chunk {index}: haha ok see u tmrw"
+            for index in range(chunks)
+        ]
+        vectors = rng.standard_normal((chunks, dims), dtype=np.float32)
+        vector_store = FAISS.from_embeddings(
+            list(zip(texts, vectors.tolist())), bot.embeddings
+        )
+        bot.save_style_index(user_id, vector_store)
+
+
+# Touch every user in this process and report its numbers as JSON
+async def measure(users: int, cap: int, dims: int) -> None:
+    bot = load_bot()
+    bot.MAX_RESIDENT_STYLE_INDEXES = cap
+    query = np.random.default_rng(1).standard_normal(dims).tolist()
+    rss_before = rss_mb()
+
+    async def lookup(user_id: int) -> tuple:
+        started = time.perf_counter()
+        vector_store = await bot.get_style_index(user_id)
+        loaded = time.perf_counter() - started
+        started = time.perf_counter()
+        vector_store.similarity_search_by_vector(query, k=bot.STYLE_EXAMPLES)
+        return loaded, time.perf_counter() - started
+
+    cold = [await lookup(user_id) for user_id in range(users)]
+    rss = rss_mb() - rss_before
+    # The most recent users are still resident and answer from RAM
+    warm = [await lookup(user_id) for user_id in range(users - 100, users)]
+    print(
+        json.dumps(
+            {
+                "rss": rss,
+                "resident": len(bot.conversation_stores),
+                "cold_load_ms": 1000 * statistics.mean(t for t, _ in cold),
+                "warm_load_us": 1e6 * statistics.mean(t for t, _ in warm),
+                "search_ms": 1000 * statistics.mean(t for _, t in warm),
+            }
+        )
+    )
+
+
+def main(users: int, chunks: int, dims: int) -> None:
+    index_dir = tempfile.mkdtemp(prefix="rizzard-bench-styles-")
+    os.environ["STYLE_INDEX_DIR"] = index_dir
+    bot = load_bot()
+    started = time.perf_counter()
+    build(bot, users, chunks, dims)
+    disk = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(index_dir)
+        for name in names
+    )
+    print(
+        f"{users} users, {chunks} chunks of {dims} dimensions each, built in "
+        f"{time.perf_counter() - started:.0f} s, {disk / 1024 / 1024:.0f} MB on disk"
+    )
+
+    print(
+        f"{'cap':>9} {'RSS MB':>7} {'resident':>8} {'cold load ms':>12} "
+        f"{'warm load us':>12} {'search ms':>9}"
+    )
+    for cap in (bot.MAX_RESIDENT_STYLE_INDEXES, users):
+        output = subprocess.run(
+            [sys.executable, __file__, "--measure", str(cap)]
+            + ["--users", str(users), "--dims", str(dims)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        label = "none" if cap == users else str(cap)
+        print(
+            f"{label:>9} {result['rss']:>7.1f} {result['resident']:>8} "
+            f"{result['cold_load_ms']:>12.2f} {result['warm_load_us']:>12.1f} "
+            f"{result['search_ms']:>9.3f}"
+        )
+    shutil.rmtree(index_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--measure", type=int, metavar="CAP")
+    args = parser.parse_args()
+    if args.measure:
+        asyncio.run(measure(args.users, args.measure, args.dims))
+    else:
+        main(args.users, args.chunks, args.dims)
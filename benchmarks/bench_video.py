@@ -0,0 +1,65 @@
+"""End-to-end latency of process_video_message on synthetic clips.
+
+Each clip goes through the whole handler: audio transcription and the frame
+pipeline run side by side, then the reply and its voice note are produced.
+Everything runs against a local fake OpenAI server. The audio and frame branches
+are also timed alone, to show how much of them overlaps. Needs ffmpeg on PATH.
+
+    python benchmarks/bench_video.py --clips 10,30,60 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import time
+
+from bench_concurrency import load_bot
+from fake_openai import FakeOpenAI
+from fake_telegram import FakeContext, FakeMessage, FakeUpdate, FakeVideo
+from synthetic_video import make_clip
+
+
+async def main(clips, latency: float) -> None:
+    server = FakeOpenAI(latency=latency).start()
+    bot = load_bot(server)
+    # Every run pays for its model calls, as a video seen for the first time would
+    bot.vision_cache.get = lambda key: None
+    bot.TTS_CACHE_MAX_CHARS = 0
+
+    async def timed(coroutine) -> float:
+        started = time.perf_counter()
+        await coroutine
+        return time.perf_counter() - started
+
+    print(f"Fake model latency: {latency:.2f} s per call")
+    print(
+        f"{'clip s':>6} {'frames':>6} {'audio s':>7} {'frames s':>8} "
+        f"{'end-to-end s':>12} {'vision':>6} {'chat':>4} {'whisper':>7} {'tts':>3}"
+    )
+    for seconds in clips:
+        path = make_clip(seconds)
+        with open(path, "rb") as f:
+            data = f.read()
+
+        audio = await timed(bot.transcribe_video_audio(path))
+        frames = await timed(bot.summarize_video_frames(path, user_id=seconds))
+
+        sent = []
+        video = FakeVideo(f"clip-{seconds}", data)
+        update = FakeUpdate(FakeMessage(sent, seconds, video=video))
+        server.reset()
+        sent_before = bot.video_frame_stats["sent"]
+        total = await timed(bot.process_video_message(update, FakeContext()))
+        print(
+            f"{seconds:>6} {bot.video_frame_stats['sent'] - sent_before:>6} "
+            f"{audio:>7.2f} {frames:>8.2f} {total:>12.2f} "
+            f"{server.counts['vision']:>6} {server.counts['chat']:>4} "
+            f"{server.counts['whisper']:>7} {server.counts['tts']:>3}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clips", default="10,30,60")
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(main([int(n) for n in args.clips.split(",")], args.latency))
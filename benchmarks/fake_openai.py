@@ -0,0 +1,147 @@
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+
+from aiohttp import web
+
+# Local stand-in for the OpenAI API: answers after a fixed delay and counts requests
+CHAT_REPLY = "Keep it light and ask about her weekend, you should say: hey, how was it?"
+OCR_REPLY = (
+    "Me: haha ok see u tmrw 😂\n"
+    "Alex: Are you coming tonight?\n"
+    "Me: yeah obviously!! wouldn't miss it"
+)
+TRANSCRIPT = "Okay so this is the rooftop bar I was telling you about."
+SPEECH_AUDIO = b"OggS" + bytes(4000)  # Only its size matters to the bot
+
+
+class FakeOpenAI:
+    def __init__(self, latency: float = 0.5, port: int = 8765):
+        self.latency = latency
+        self.port = port
+        self.counts = Counter()
+        self.screenshots_read = 0  # Never reset, so texts differ across runs too
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.loop = asyncio.new_event_loop()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def reset(self) -> None:
+        self.counts.clear()
+        self.max_in_flight = 0
+
+    # Track how many requests the server is answering at the same time
+    async def delay(self) -> None:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        has_image = any(
+            isinstance(message.get("content"), list)
+            and any(part.get("type") == "image_url" for part in message["content"])
+            for message in body["messages"]
+        )
+        self.counts["vision" if has_image else "chat"] += 1
+        # Each screenshot reads differently, so chunks are not deduplicated by cache
+        if has_image:
+            self.screenshots_read += 1
+            content = f"{OCR_REPLY}\nAlex: screenshot {self.screenshots_read}"
+        else:
+            content = CHAT_REPLY
+        await self.delay()
+        if body.get("stream"):
+            return await self.stream_completion(request, body, content)
+        return web.json_response(
+            {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o-mini"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": content,
+                        },
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 1,
+                    "completion_tokens": 1,
+                    "total_tokens": 2,
+                },
+            }
+        )
+
+    # Server-sent events in the shape of the OpenAI streaming API, a word per chunk
+    async def stream_completion(
+        self, request: web.Request, body: dict, content: str
+    ) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        words = content.split(" ")
+        for index, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o-mini"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if index == 0 else f" {word}"},
+                        "finish_reason": "stop" if index == len(words) - 1 else None,
+                    }
+                ],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def transcriptions(self, request: web.Request) -> web.Response:
+        await request.read()
+        self.counts["whisper"] += 1
+        await self.delay()
+        return web.json_response({"text": TRANSCRIPT})
+
+    async def speech(self, request: web.Request) -> web.Response:
+        await request.read()
+        self.counts["tts"] += 1
+        await self.delay()
+        return web.Response(body=SPEECH_AUDIO, content_type="audio/ogg")
+
+    async def serve(self, ready: threading.Event) -> None:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/audio/transcriptions", self.transcriptions)
+        app.router.add_post("/v1/audio/speech", self.speech)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", self.port).start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    # Serve from a thread with its own event loop, so a blocked client can't stall it
+    def start(self) -> "FakeOpenAI":
+        ready = threading.Event()
+
+        def run() -> None:
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.serve(ready))
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self
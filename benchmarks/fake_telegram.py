@@ -0,0 +1,102 @@
+import asyncio
+import itertools
+from datetime import datetime, timezone
+
+# Minimal stand-ins for the Telegram objects the handlers touch
+message_ids = itertools.count(1)
+
+
+class FakeFile:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def download_as_bytearray(self) -> bytearray:
+        return bytearray(self.data)
+
+
+class FakePhoto:
+    def __init__(self, file_unique_id: str, data: bytes):
+        self.file_unique_id = file_unique_id
+        self.data = data
+
+    async def get_file(self) -> FakeFile:
+        return FakeFile(self.data)
+
+
+class FakeVideo(FakePhoto):
+    pass
+
+
+class FakeVoice:
+    def __init__(self, file_id: str):
+        self.file_id = file_id
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+# Records every message the bot sends or edits in the shared sent list
+class FakeMessage:
+    def __init__(
+        self,
+        sent: list,
+        user_id: int,
+        text=None,
+        photo=None,
+        caption=None,
+        media_group_id=None,
+        video=None,
+    ):
+        self.sent = sent
+        self.message_id = next(message_ids)
+        self.date = datetime.now(timezone.utc)
+        self.from_user = FakeUser(user_id)
+        self.text = text
+        self.photo = [photo] if photo is not None else []
+        self.caption = caption
+        self.media_group_id = media_group_id
+        self.video = video
+
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        self.sent.append(("send", text))
+        return FakeMessage(self.sent, self.from_user.id, text=text)
+
+    async def reply_voice(self, voice, **kwargs) -> "FakeMessage":
+        self.sent.append(("voice", voice))
+        message = FakeMessage(self.sent, self.from_user.id)
+        message.voice = FakeVoice(f"voice-{message.message_id}")
+        return message
+
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        self.sent.append(("edit", text))
+        self.text = text
+        return self
+
+
+class FakeUpdate:
+    def __init__(self, message: FakeMessage):
+        self.message = message
+        self.effective_message = message
+        self.effective_user = message.from_user
+        self.effective_chat = FakeChat(message.from_user.id)
+
+
+class FakeBot:
+    async def send_chat_action(self, chat_id: int, action: str) -> None:
+        await asyncio.sleep(0)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> None:
+        print(f"Bot message: {text}")
+
+
+class FakeContext:
+    def __init__(self):
+        self.bot = FakeBot()
+        self.user_data = {}
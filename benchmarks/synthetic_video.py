@@ -0,0 +1,38 @@
+import os
+import subprocess
+import tempfile
+from typing import Optional
+
+# Synthetic clips made by ffmpeg, which the bot needs anyway: a continuous zoom,
+# so sampled frames keep changing and survive deduplication
+CLIP_DIR = os.path.join(tempfile.gettempdir(), "rizzard-bench-clips")
+
+
+# keyframe_interval=None keeps x264's default of 250 frames, phones use about 30
+def make_clip(
+    seconds: int,
+    width: int = 640,
+    height: int = 360,
+    audio=True,
+    keyframe_interval: Optional[int] = None,
+) -> str:
+    os.makedirs(CLIP_DIR, exist_ok=True)
+    name = f"{seconds}s-{width}x{height}{'-audio' if audio else ''}"
+    if keyframe_interval is not None:
+        name += f"-g{keyframe_interval}"
+    path = os.path.join(CLIP_DIR, f"{name}.mp4")
+    if os.path.exists(path):
+        return path
+    inputs = ["-f", "lavfi", "-i", f"mandelbrot=size={width}x{height}:rate=30"]
+    if audio:
+        inputs += ["-f", "lavfi", "-i", "sine=frequency=440"]
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-y", *inputs, "-t", str(seconds)]
+        + ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p"]
+        + (["-g", str(keyframe_interval)] if keyframe_interval else [])
+        + (["-c:a", "aac"] if audio else [])
+        + [f"{path}.tmp.mp4"],
+        check=True,
+    )
+    os.replace(f"{path}.tmp.mp4", path)  # An interrupted run leaves no partial clip
+    return path
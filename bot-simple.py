@@ -1,4 +1,6 @@
 import os
+import tiktoken
+from asyncio import create_task
 from openai import AsyncOpenAI
 from telegram import Update
 from telegram.ext import (
@@ -17,6 +19,87 @@ client = AsyncOpenAI(api_key=OPEN_AI_KEY)
 # Dictionary to store conversation history for each user
 user_conversations = defaultdict(list)
 
+# Older turns beyond the token budget are folded into a rolling summary
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 2000))
+user_summaries = {}
+summary_tasks = {}
+encoding = tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(messages) -> int:
+    return sum(len(encoding.encode(message["content"])) + 4 for message in messages)
+
+
+async def fold_into_summary(user_id, dropped) -> None:
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in dropped)
+    try:
+        response = await client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {
+                    "role": "system",
+                    "content": "Update the running summary of this coaching conversation. "
+                    "Keep names, preferences, what worked and what didn't. "
+                    "Answer with the summary only, in under 200 words.",
+                },
+                {
+                    "role": "user",
+                    "content": f"Current summary:\n{user_summaries.get(user_id) or '(empty)'}"
+                    f"\n\nNew messages:\n{transcript}",
+                },
+            ],
+        )
+    except Exception as e:
+        print(f"Error refreshing summary: {e}")
+        return
+    user_summaries[user_id] = response.choices[0].message.content
+
+
+def compact_conversation(user_id):
+    conversation = user_conversations[user_id]
+    # The system prompt set by /start stays pinned at the top
+    pinned = (
+        conversation[:1]
+        if conversation and conversation[0]["role"] == "assistant"
+        else []
+    )
+    turns = conversation[len(pinned) :]
+
+    start = len(turns)
+    kept_tokens = 0
+    while start > 0:
+        tokens = count_tokens([turns[start - 1]])
+        if kept_tokens + tokens > HISTORY_TOKEN_BUDGET and start < len(turns):
+            break
+        kept_tokens += tokens
+        start -= 1
+    while start < len(turns) - 1 and turns[start]["role"] != "user":
+        start += 1
+
+    dropped, kept = turns[:start], turns[start:]
+    if dropped:
+        # Chain summary updates so turns are folded in order
+        previous = summary_tasks.get(user_id)
+
+        async def fold():
+            if previous is not None:
+                await previous
+            await fold_into_summary(user_id, dropped)
+
+        summary_tasks[user_id] = create_task(fold())
+        user_conversations[user_id] = pinned + kept
+        print(f"History compacted for {user_id}: {count_tokens(dropped)} tokens saved")
+
+    summary = user_summaries.get(user_id)
+    if summary:
+        pinned = pinned + [
+            {
+                "role": "system",
+                "content": f"Summary of the earlier conversation: {summary}",
+            }
+        ]
+    return pinned + kept
+
 
 async def start(update: Update, context: CallbackContext) -> None:
     user_id = update.message.from_user.id
@@ -134,7 +217,7 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
 
     # Generate a response from OpenAI
     response = await client.chat.completions.create(
-        model="gpt-4o-mini", messages=user_conversations[user_id]
+        model="gpt-4o-mini", messages=compact_conversation(user_id)
     )
 
     assistant_message = response.choices[0].message.content
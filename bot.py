@@ -1,8 +1,19 @@
 import os
-import subprocess
+import hashlib
+import heapq
+import itertools
+import json
+import queue
+import random
+import re
+import shutil
+import sqlite3
+import threading
+import time
 import tempfile
-import uuid
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ChatAction
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -14,33 +25,50 @@ from telegram.ext import (
 from langchain_openai import ChatOpenAI
 from langchain_xai import ChatXAI
 
-from langchain_core.messages import HumanMessage
-from langchain_core.chat_history import (
-    InMemoryChatMessageHistory,
-    BaseChatMessageHistory,
+from langchain_core.messages import (
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    message_to_dict,
+    messages_from_dict,
 )
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from openai import OpenAI
-import ffmpeg
 from PIL import Image  # For handling image files
 import io
-from moviepy import VideoFileClip
 
 
 import cv2  # For processing images and videos
+import numpy as np
 from openai import AsyncOpenAI  # To interact with OpenAI API asynchronously
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    BadRequestError,
+    InternalServerError,
+    RateLimitError,
+)
 import base64  # For encoding images to base64
 
 import stripe
+import tiktoken
 
 from flask import Flask, request, jsonify
 
 from langchain_community.vectorstores import FAISS
 from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import CharacterTextSplitter
-from asyncio import Task, create_task, sleep
-from typing import Dict
+from asyncio import Condition, Event, Semaphore, Task, create_task, gather, sleep
+from asyncio import TimeoutError, to_thread, wait_for
+from asyncio import create_subprocess_exec, get_running_loop
+from asyncio.subprocess import PIPE
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Sequence
 
 app = Flask(__name__)
 
@@ -52,13 +80,156 @@ stripe_secret_key = os.environ.get("STRIPE_SECRET_KEY")
 
 stripe.api_key = stripe_secret_key
 
-model = ChatOpenAI(model="gpt-4o-mini")
+# Retries are handled by call_openai so they go through the rate limiter
+model = ChatOpenAI(model="gpt-4o-mini", max_retries=0)
 # model = ChatXAI(xai_api_key=os.environ.get("XAI_API_KEY"), model="grok-beta")
 
-client = AsyncOpenAI(api_key=openai_api_key)
+client = AsyncOpenAI(api_key=openai_api_key, max_retries=0)
+
+# OpenAI quotas per endpoint: (requests per minute, tokens per minute or None)
+OPENAI_RATE_LIMITS = {
+    "chat": (500, 200_000),
+    "vision": (500, 200_000),
+    "whisper": (50, None),
+    "tts": (50, None),
+    "embeddings": (3000, 1_000_000),
+}
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", 4))
+OPENAI_RETRY_BASE_DELAY = 1.0
+RETRYABLE_OPENAI_ERRORS = (
+    RateLimitError,
+    APITimeoutError,
+    APIConnectionError,
+    InternalServerError,
+)
+
+# Priority lanes, lower goes first: text replies before media before video
+PRIORITY_TEXT = 0
+PRIORITY_MEDIA = 1
+PRIORITY_VIDEO = 2
+PRIORITY_BACKGROUND = 3
+request_priority = ContextVar("request_priority", default=PRIORITY_TEXT)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self.refill()
+        missing = min(amount, self.capacity) - self.available
+        return max(missing / self.rate, 0.0)
+
+    def consume(self, amount: float) -> None:
+        self.available -= min(amount, self.capacity)
+
+
+# Request and token buckets for one endpoint, waiters served by priority lane
+class EndpointLimiter:
+    def __init__(self, requests_per_minute: int, tokens_per_minute: Optional[int]):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.waiting = []  # Heap of (priority, sequence)
+        self.sequence = itertools.count()
+        self.condition = Condition()
+
+    def wait_time(self, tokens: int) -> float:
+        wait = self.requests.wait_time(1)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    async def acquire(self, tokens: int, priority: int) -> None:
+        ticket = (priority, next(self.sequence))
+        async with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            self.condition.notify_all()  # A more urgent waiter may now be first
+            try:
+                while True:
+                    if self.waiting[0] != ticket:
+                        await self.condition.wait()
+                        continue
+                    wait = self.wait_time(tokens)
+                    if wait <= 0:
+                        break
+                    try:
+                        await wait_for(self.condition.wait(), wait)
+                    except TimeoutError:
+                        pass
+            except BaseException:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+                raise
+
+            heapq.heappop(self.waiting)
+            self.requests.consume(1)
+            if self.tokens is not None:
+                self.tokens.consume(tokens)
+            self.condition.notify_all()
+
+
+rate_limiters = {
+    endpoint: EndpointLimiter(requests, tokens)
+    for endpoint, (requests, tokens) in OPENAI_RATE_LIMITS.items()
+}
+
 
-# Storage for session histories
-store = {}
+# Every OpenAI call goes through here: quota first, then jittered retries
+async def call_openai(endpoint: str, call, tokens: int = 0):
+    limiter = rate_limiters[endpoint]
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        await limiter.acquire(tokens, request_priority.get())
+        try:
+            return await call()
+        except RETRYABLE_OPENAI_ERRORS as e:
+            if attempt == OPENAI_MAX_RETRIES:
+                raise
+            delay = OPENAI_RETRY_BASE_DELAY * 2**attempt * random.uniform(0.5, 1.5)
+            print(f"OpenAI {endpoint} call failed ({e}), retrying in {delay:.1f} s")
+            await sleep(delay)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(token_encoding.encode(text))
+
+
+# Session history settings
+HISTORY_DB_PATH = os.environ.get("HISTORY_DB_PATH", "history.db")
+HISTORY_REDIS_URL = os.environ.get("HISTORY_REDIS_URL")  # Optional Redis backend
+MAX_HISTORY_MESSAGES = int(os.environ.get("MAX_HISTORY_MESSAGES", 50))
+MAX_CACHED_SESSIONS = int(os.environ.get("MAX_CACHED_SESSIONS", 1000))
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 2000))
+
+# Vision result cache settings (set VISION_CACHE_DB_PATH to enable the disk tier)
+VISION_CACHE_SIZE = int(os.environ.get("VISION_CACHE_SIZE", 2000))
+VISION_CACHE_TTL = float(os.environ.get("VISION_CACHE_TTL", 7 * 24 * 3600))
+VISION_CACHE_DB_PATH = os.environ.get("VISION_CACHE_DB_PATH")
+
+# Media index settings (artifacts derived from each Telegram file_unique_id)
+MEDIA_INDEX_SIZE = int(os.environ.get("MEDIA_INDEX_SIZE", 5000))
+MEDIA_INDEX_TTL = float(os.environ.get("MEDIA_INDEX_TTL", 30 * 24 * 3600))
+MEDIA_INDEX_DB_PATH = os.environ.get("MEDIA_INDEX_DB_PATH")
+
+# Text-to-speech settings and on-disk cache of short voice replies
+TTS_MODEL = "tts-1"
+TTS_VOICE = "nova"
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+TTS_CACHE_MAX_CHARS = int(os.environ.get("TTS_CACHE_MAX_CHARS", 300))
+
+# Storage for session histories (LRU of sessions kept in RAM, backed by disk)
+store: "OrderedDict[str, BaseChatMessageHistory]" = OrderedDict()
 
 # Add this near other global variables
 user_languages = {}  # Store user language preferences
@@ -72,9 +243,196 @@ DEFAULT_CONFIG = {
     "language": "en",
 }
 
+# Embedding settings: "openai", "local" (sentence-transformers) or "fake" (offline)
+EMBEDDINGS_PROVIDER = os.environ.get("EMBEDDINGS_PROVIDER", "openai")
+EMBEDDINGS_LOCAL_MODEL = os.environ.get(
+    "EMBEDDINGS_LOCAL_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
+)
+EMBEDDINGS_CACHE_DB_PATH = os.environ.get("EMBEDDINGS_CACHE_DB_PATH", "embeddings.db")
+EMBEDDINGS_BATCH_WINDOW = 0.05  # Seconds to wait for other requests to batch with
+EMBEDDINGS_MAX_BATCH = 256
+# Vectors kept on disk, about 150 MB at OpenAI's 1536 dimensions
+EMBEDDINGS_CACHE_MAX_ROWS = int(os.environ.get("EMBEDDINGS_CACHE_MAX_ROWS", 50_000))
+
+
+# Embeddings in front of a model: cached on disk as float16 up to a row cap, deduped
+# by text hash, and micro-batched across all callers by a background thread
+class CachedBatchEmbeddings(Embeddings):
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_id: str,
+        db_path: str,
+        max_rows: int = EMBEDDINGS_CACHE_MAX_ROWS,
+    ):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, used_at REAL NOT NULL)"
+        )
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(embeddings)")
+        ]
+        if "used_at" not in columns:  # Written before the cache was bounded
+            self.connection.execute(
+                "ALTER TABLE embeddings ADD COLUMN used_at REAL NOT NULL DEFAULT 0"
+            )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_used_at ON embeddings (used_at)"
+        )
+        self.requests: "queue.Queue[tuple]" = queue.Queue()
+        threading.Thread(target=self.run_batches, daemon=True).start()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_id}|{text}".encode()).hexdigest()
+
+    def embed_documents(
+        self, texts: List[str], cache: bool = True
+    ) -> List[List[float]]:
+        keys = [self.key(text) for text in texts]
+        vectors = self.load(set(keys))
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if missing:
+            future = Future()
+            self.requests.put((missing, future, cache))
+            vectors.update(future.result())
+        return [vectors[key] for key in keys]
+
+    # Queries are one-off user messages, so they are batched but never stored
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text], cache=False)[0]
+
+    def load(self, keys: set) -> Dict[str, List[float]]:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                list(keys),
+            ).fetchall()
+            # Mark the hits as recently used for LRU eviction
+            self.connection.executemany(
+                "UPDATE embeddings SET used_at = ? WHERE key = ?",
+                [(time.time(), key) for key, _ in rows],
+            )
+        return {
+            key: np.frombuffer(blob, dtype=np.float16).astype(np.float32).tolist()
+            for key, blob in rows
+        }
+
+    def store(self, vectors: Dict[str, List[float]]) -> None:
+        if not vectors:
+            return
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, used_at) "
+                "VALUES (?, ?, ?)",
+                [
+                    (key, np.asarray(vector, dtype=np.float16).tobytes(), now)
+                    for key, vector in vectors.items()
+                ],
+            )
+            # Drop the least recently used rows beyond the cap
+            self.connection.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings "
+                "ORDER BY used_at LIMIT max(0, "
+                "(SELECT COUNT(*) FROM embeddings) - ?))",
+                (self.max_rows,),
+            )
+
+    def run_batches(self) -> None:
+        while True:
+            # Collect whatever arrives within the window into one model call
+            pending = [self.requests.get()]
+            deadline = time.monotonic() + EMBEDDINGS_BATCH_WINDOW
+            while sum(len(request[0]) for request in pending) < EMBEDDINGS_MAX_BATCH:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            texts = {}
+            for missing, _, _ in pending:
+                texts.update(missing)
+            try:
+                keys = list(texts)
+                result = self.embeddings.embed_documents([texts[key] for key in keys])
+                vectors = dict(zip(keys, result))
+                self.store(
+                    {
+                        key: vectors[key]
+                        for missing, _, cache in pending
+                        if cache
+                        for key in missing
+                    }
+                )
+            except Exception as e:
+                for _, future, _ in pending:
+                    future.set_exception(e)
+                continue
+            for missing, future, _ in pending:
+                future.set_result({key: vectors[key] for key in missing})
+
+
+def create_embedding_model() -> Embeddings:
+    if EMBEDDINGS_PROVIDER == "fake":
+        return DeterministicFakeEmbedding(size=384)
+    if EMBEDDINGS_PROVIDER == "local":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(model_name=EMBEDDINGS_LOCAL_MODEL)
+    return OpenAIEmbeddings(max_retries=0)
+
+
 # Initialize vector store for conversation history
-embeddings = OpenAIEmbeddings()
-conversation_stores = {}  # Store per-user vector stores
+embedding_model = create_embedding_model()
+embeddings = CachedBatchEmbeddings(
+    embedding_model,
+    getattr(embedding_model, "model", None)
+    or getattr(embedding_model, "model_name", EMBEDDINGS_PROVIDER),
+    EMBEDDINGS_CACHE_DB_PATH,
+)
+# Per-user vector stores live on disk, only recently used ones stay in RAM
+STYLE_INDEX_DIR = os.environ.get("STYLE_INDEX_DIR", "style_indexes")
+MAX_RESIDENT_STYLE_INDEXES = int(os.environ.get("MAX_RESIDENT_STYLE_INDEXES", 200))
+conversation_stores: "OrderedDict[int, FAISS]" = OrderedDict()
+
+# Style matching: "inline" puts the user's style into the main call, "rewrite" uses
+# the legacy second call to restyle the suggestion. Both are timed for comparison.
+STYLE_MODE = os.environ.get("STYLE_MODE", "inline").lower()
+STYLE_EXAMPLES = 2  # Examples retrieved per turn when retrieval is used
+STYLE_RETRIEVAL = os.environ.get("STYLE_RETRIEVAL", "false").lower() == "true"
+STYLE_DIGEST_SAMPLE = 12  # Most recent chunks the digest is written from
+style_digests: Dict[int, str] = {}  # Cached style profile digest per user
+digest_tasks: Dict[int, Task] = {}
+STYLE_DIGEST_RETRY_DELAY = 300.0  # Seconds before a failed digest is tried again
+digest_retry_at: Dict[int, float] = {}  # Earliest retry after a failed digest
+style_index_versions: Dict[int, int] = {}  # Bumped each time an index changes
+style_stats = {
+    mode: {"replies": 0, "total_latency": 0.0} for mode in ("inline", "rewrite")
+}
+
+# Style profile: running statistics of the user's own messages, one per user
+STYLE_PROFILE_WORDS = 200  # Word counts kept, the rest is pruned
+STYLE_PROFILE_TOP_WORDS = 12  # Favourite words shown to the model
+STYLE_PROFILE_SAMPLES = 6  # Most recent sample lines kept
+MESSAGE_LENGTH_BUCKETS = [20, 50, 100, 200]  # Upper bounds in characters
+EMOJI_PATTERN = re.compile("[\U0001f000-\U0001faff\u2600-\u27bf]")
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+COMMON_WORDS = set(
+    "the a an and or but to of in on at for is are was it i you he she we they "
+    "me my your that this be do so with not le la les un une et ou de des du en "
+    "je tu il elle on nous vous ils est pas que qui ce ça mais pour avec".split()
+)
 
 # Add message translations
 MESSAGES = {
@@ -108,7 +466,9 @@ Your settings have been saved. You can edit them anytime by typing /settings
 
 Would you like to help me understand your conversation style?
 To help me understand your conversation style, send me screenshots of your past conversations with the caption 'learn'.""",
+        "busy": "Hold on, I'm still on your last messages. Give me a sec!",
         "processed_conversation": "Thanks! I've learned from your conversation style. I'll use this to provide more personalized suggestions.",
+        "processed_album": "Thanks! I've learned from these {count} conversations. I'll use them to provide more personalized suggestions.",
         "gender_updated": "Your gender has been set to: {gender}",
         "preference_updated": "Your sexual preference has been set to: {preference}",
         "config_name": "name",
@@ -151,7 +511,9 @@ Tes paramètres ont été enregistrés. Tu peux les modifier à tout moment en t
 
 Tu veux m'aider à comprendre ton style de conversation ?
 Pour m'aider à comprendre ton style de conversation, envoie-moi des captures d'écran de tes conversations passées avec la légende 'learn'.""",
+        "busy": "Attends, je suis encore sur tes derniers messages. Une seconde !",
         "processed_conversation": "Merci ! J'ai appris de ton style de conversation. Je vais l'utiliser pour fournir des suggestions plus personnalisées.",
+        "processed_album": "Merci ! J'ai appris de ces {count} conversations. Je vais les utiliser pour fournir des suggestions plus personnalisées.",
         "gender_updated": "Ton genre a été défini sur : {gender}",
         "preference_updated": "Ta préférence sexuelle a été définie sur : {preference}",
         "config_name": "nom",
@@ -168,7 +530,59 @@ Pour m'aider à comprendre ton style de conversation, envoie-moi des captures d'
 
 # Add these near other global variables
 typing_tasks: Dict[int, Task] = {}  # Store typing tasks per user
-DEBOUNCE_DELAY = 10.0  # Delay in seconds before processing messages
+DEBOUNCE_DELAY = 10.0  # Longest wait in seconds after a message before processing
+DEBOUNCE_MIN_DELAY = 1.5  # Shortest wait, also used before we know the user's pace
+DEBOUNCE_MAX_WAIT = 20.0  # Longest a burst is held after its first message
+pending_messages: Dict[int, List[str]] = {}  # Texts of the current burst per user
+burst_started: Dict[int, float] = {}  # When the current burst began per user
+message_gaps: Dict[int, float] = {}  # Moving average of in-burst gaps per user
+debounce_stats = {"messages": 0, "calls": 0}
+
+# Streamed replies: the first tokens are sent right away, then the message is edited
+STREAM_REPLIES = os.environ.get("STREAM_REPLIES", "true").lower() == "true"
+STREAM_EDIT_INTERVAL = 1.5  # Seconds between edits, Telegram allows about 1 per second
+TYPING_HEARTBEAT_INTERVAL = 4.0  # The typing status shows for about 5 seconds
+streaming_stats = {"replies": 0, "total_first_token": 0.0}
+
+# Albums: photos of a media group are collected and handled together
+ALBUM_COLLECT_DELAY = 1.5  # Seconds to wait for the next photo of an album
+LEARN_OCR_CONCURRENCY = 4  # Screenshots of an album read at the same time
+pending_albums: Dict[str, List[Update]] = {}  # Updates collected per media group
+album_tasks: Dict[str, Task] = {}
+
+# Scheduler: one ordered queue per user, served round-robin by a worker pool
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", 8))
+MAX_USER_QUEUE = int(os.environ.get("MAX_USER_QUEUE", 5))
+user_queues: Dict[int, Deque[tuple]] = {}  # user_id -> (enqueued_at, job)
+ready_users: Deque[int] = deque()  # Users with queued work and nothing running
+running_users = set()
+work_available = Event()
+scheduler_stats = {"queue_depth": 0, "jobs": 0, "total_wait": 0.0, "max_wait": 0.0}
+
+# Concurrency limits for vision calls on video frames
+VISION_GLOBAL_CONCURRENCY = int(os.environ.get("VISION_GLOBAL_CONCURRENCY", 8))
+VISION_USER_CONCURRENCY = int(os.environ.get("VISION_USER_CONCURRENCY", 3))
+vision_semaphore = Semaphore(VISION_GLOBAL_CONCURRENCY)
+user_vision_semaphores: Dict[int, Semaphore] = {}
+
+# Video frame sampling: "fps", "max_frames" or "scene"
+FRAME_SAMPLING_MODE = os.environ.get("FRAME_SAMPLING_MODE", "fps")
+FRAME_SAMPLING_FPS = float(os.environ.get("FRAME_SAMPLING_FPS", 1.0))
+MAX_SAMPLED_FRAMES = int(os.environ.get("MAX_SAMPLED_FRAMES", 60))
+SCENE_CHANGE_THRESHOLD = float(os.environ.get("SCENE_CHANGE_THRESHOLD", 0.3))
+SCENE_ANALYSIS_FPS = 2.0  # How often frames are checked for a scene change
+
+# Frames whose perceptual hashes differ by at most this many bits are duplicates
+FRAME_DEDUP_THRESHOLD = int(os.environ.get("FRAME_DEDUP_THRESHOLD", 6))
+video_frame_stats = {"sampled": 0, "sent": 0}
+
+# Worker processes for CPU-heavy video work (frame decoding and hashing)
+VIDEO_PROCESS_WORKERS = int(os.environ.get("VIDEO_PROCESS_WORKERS", 2))
+video_process_pool = ProcessPoolExecutor(max_workers=VIDEO_PROCESS_WORKERS)
+
+# Token budgets for the map-reduce video summary
+SUMMARY_BATCH_TOKENS = int(os.environ.get("SUMMARY_BATCH_TOKENS", 2000))
+SUMMARY_MAX_TOKENS = int(os.environ.get("SUMMARY_MAX_TOKENS", 300))
 
 
 # Helper function to get message in user's language
@@ -495,16 +909,398 @@ Prefer to answer in a short, casual style, with short sentences.""",
         MessagesPlaceholder(variable_name="messages"),
     ]
 )
-chain = prompt | model
+# Rolling summaries of the turns that no longer fit in the token budget are kept
+# with each session's history, only the running refreshes are tracked here
+summary_tasks: Dict[str, Task] = {}
+token_encoding = tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(messages: Sequence[BaseMessage]) -> int:
+    # Roughly 4 tokens of per-message overhead on top of the content
+    return sum(len(token_encoding.encode(str(m.content))) + 4 for m in messages)
+
+
+def split_history_window(messages: List[BaseMessage], budget: int):
+    # Keep the newest messages that fit in the budget, starting on a human turn
+    kept_tokens = 0
+    start = len(messages)
+    while start > 0:
+        tokens = count_tokens([messages[start - 1]])
+        if kept_tokens + tokens > budget and start < len(messages):
+            break
+        kept_tokens += tokens
+        start -= 1
+    while start < len(messages) - 1 and not isinstance(messages[start], HumanMessage):
+        start += 1
+    return messages[:start], messages[start:]
+
+
+async def refresh_history_summary(session_id: str, dropped: List[BaseMessage]) -> None:
+    cached = get_session_history(session_id).summary
+    # Only fold the turns that came after the last one already in the summary
+    new_messages = dropped
+    if cached["last_folded"] is not None:
+        for index in range(len(dropped) - 1, -1, -1):
+            if message_to_dict(dropped[index]) == cached["last_folded"]:
+                new_messages = dropped[index + 1 :]
+                break
+    if not new_messages:
+        return
+
+    transcript = "\n".join(f"{m.type}: {m.content}" for m in new_messages)
+    summary_messages = [
+        SystemMessage(
+            content="Update the running summary of this coaching conversation. "
+            "Keep names, preferences, what worked and what didn't. "
+            "Answer with the summary only, in under 200 words."
+        ),
+        HumanMessage(
+            content=f"Current summary:\n{cached['summary'] or '(empty)'}\n\n"
+            f"New messages:\n{transcript}"
+        ),
+    ]
+    # This runs in its own task, so the lower priority only applies here
+    request_priority.set(PRIORITY_BACKGROUND)
+    try:
+        response = await call_openai(
+            "chat",
+            lambda: model.ainvoke(summary_messages),
+            tokens=count_tokens(summary_messages) + 300,
+        )
+    except Exception as e:
+        print(f"Error refreshing history summary: {e}")
+        return
+
+    # Looked up again, the session may have been evicted while we waited
+    get_session_history(session_id).set_summary(
+        {
+            "summary": response.content,
+            "last_folded": message_to_dict(new_messages[-1]),
+        }
+    )
+
+
+# Trim the history to the token budget and fold older turns into the summary
+async def compact_history(
+    messages: List[BaseMessage], config: RunnableConfig
+) -> List[BaseMessage]:
+    session_id = str(config["configurable"]["session_id"])
+    dropped, kept = split_history_window(messages, HISTORY_TOKEN_BUDGET)
+    if not dropped:
+        return messages
+
+    # The summary is refreshed in the background so the reply is not delayed
+    if session_id not in summary_tasks:
+        task = create_task(refresh_history_summary(session_id, dropped))
+        summary_tasks[session_id] = task
+        task.add_done_callback(lambda _: summary_tasks.pop(session_id, None))
+
+    summary = get_session_history(session_id).summary["summary"]
+    if summary:
+        kept = [
+            SystemMessage(content=f"Summary of the earlier conversation: {summary}")
+        ] + kept
+
+    print(
+        f"History compacted for {session_id}: "
+        f"{count_tokens(messages) - count_tokens(kept)} tokens saved"
+    )
+    return kept
+
+
+# Give the model the user's texting style so suggestions come out in their voice
+def add_style_context(
+    messages: List[BaseMessage], config: RunnableConfig
+) -> List[BaseMessage]:
+    style_context = config["configurable"].get("style_context")
+    if not style_context:
+        return messages
+    style_message = SystemMessage(
+        content=(
+            "When you suggest what the user should say, write the suggestion the "
+            "way the user texts: match their tone, vocabulary, emoji and "
+            f"punctuation.\n{style_context}"
+        )
+    )
+    return messages[:-1] + [style_message] + messages[-1:]
+
+
+chain = (
+    RunnableLambda(compact_history) | RunnableLambda(add_style_context) | prompt | model
+)
+
+
+EMPTY_SUMMARY = {"summary": "", "last_folded": None}  # Before any turn was folded
+
+
+# Chat history persisted in a local SQLite database, capped per user
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    def __init__(
+        self, session_id: str, connection: sqlite3.Connection, max_messages: int
+    ):
+        self.session_id = str(session_id)
+        self.connection = connection
+        self.max_messages = max_messages
+        self._messages = None  # Loaded lazily on first access
+        self._summary = None
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        if self._messages is None:
+            with history_db_lock:
+                rows = self.connection.execute(
+                    "SELECT message FROM message_history WHERE session_id = ? "
+                    "ORDER BY id",
+                    (self.session_id,),
+                ).fetchall()
+            self._messages = messages_from_dict([json.loads(row[0]) for row in rows])
+        return list(self._messages)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        current = self.messages + list(messages)
+        with history_db_lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO message_history (session_id, message) VALUES (?, ?)",
+                [
+                    (self.session_id, json.dumps(message_to_dict(message)))
+                    for message in messages
+                ],
+            )
+            # Drop the oldest rows beyond the per-user cap
+            self.connection.execute(
+                "DELETE FROM message_history WHERE session_id = ? AND id NOT IN "
+                "(SELECT id FROM message_history WHERE session_id = ? "
+                "ORDER BY id DESC LIMIT ?)",
+                (self.session_id, self.session_id, self.max_messages),
+            )
+        self._messages = current[-self.max_messages :]
+
+    # Rolling summary of the turns that fell out of the token budget
+    @property
+    def summary(self) -> dict:
+        if self._summary is None:
+            with history_db_lock:
+                row = self.connection.execute(
+                    "SELECT summary FROM history_summary WHERE session_id = ?",
+                    (self.session_id,),
+                ).fetchone()
+            self._summary = json.loads(row[0]) if row else dict(EMPTY_SUMMARY)
+        return self._summary
+
+    def set_summary(self, summary: dict) -> None:
+        with history_db_lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO history_summary (session_id, summary) "
+                "VALUES (?, ?)",
+                (self.session_id, json.dumps(summary)),
+            )
+        self._summary = summary
+
+    def clear(self) -> None:
+        with history_db_lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM message_history WHERE session_id = ?", (self.session_id,)
+            )
+            self.connection.execute(
+                "DELETE FROM history_summary WHERE session_id = ?", (self.session_id,)
+            )
+        self._messages = []
+        self._summary = dict(EMPTY_SUMMARY)
+
+
+def open_history_db(path: str) -> sqlite3.Connection:
+    # The history may be read from executor threads by RunnableWithMessageHistory
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS message_history ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "session_id TEXT NOT NULL, "
+        "message TEXT NOT NULL)"
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS idx_message_history_session "
+        "ON message_history (session_id, id)"
+    )
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS history_summary ("
+        "session_id TEXT PRIMARY KEY, "
+        "summary TEXT NOT NULL)"
+    )
+    return connection
+
+
+history_db_lock = threading.Lock()
+history_db = None if HISTORY_REDIS_URL else open_history_db(HISTORY_DB_PATH)
+
+if HISTORY_REDIS_URL:
+    from langchain_community.chat_message_histories import RedisChatMessageHistory
+
+    # Redis history trimmed to the same per-user cap as the SQLite backend
+    class CappedRedisChatMessageHistory(RedisChatMessageHistory):
+        def add_message(self, message: BaseMessage) -> None:
+            super().add_message(message)
+            self.redis_client.ltrim(self.key, 0, MAX_HISTORY_MESSAGES - 1)
+
+        # The rolling summary sits next to the messages, under its own key
+        @property
+        def summary(self) -> dict:
+            raw = self.redis_client.get(f"{self.key}:summary")
+            return json.loads(raw) if raw else dict(EMPTY_SUMMARY)
+
+        def set_summary(self, summary: dict) -> None:
+            self.redis_client.set(f"{self.key}:summary", json.dumps(summary))
+
+        def clear(self) -> None:
+            super().clear()
+            self.redis_client.delete(f"{self.key}:summary")
+
+
+def create_session_history(session_id: str) -> BaseChatMessageHistory:
+    if HISTORY_REDIS_URL:
+        return CappedRedisChatMessageHistory(str(session_id), url=HISTORY_REDIS_URL)
+    return SQLiteChatMessageHistory(session_id, history_db, MAX_HISTORY_MESSAGES)
 
 
 # Get or create session history
-async def get_session_history(session_id: str) -> BaseChatMessageHistory:
-    if session_id not in store:
-        store[session_id] = InMemoryChatMessageHistory()
+def get_session_history(session_id: str) -> BaseChatMessageHistory:
+    session_id = str(session_id)
+    if session_id in store:
+        store.move_to_end(session_id)
+    else:
+        store[session_id] = create_session_history(session_id)
+        # Evict idle sessions from RAM, their messages stay on disk
+        while len(store) > MAX_CACHED_SESSIONS:
+            store.popitem(last=False)
     return store[session_id]
 
 
+# Single runnable shared by every handler, histories are resolved by session_id
+chain_with_history = RunnableWithMessageHistory(chain, get_session_history)
+
+
+# Size-bounded LRU cache with a TTL and an optional SQLite disk tier
+class ResultCache:
+    def __init__(self, max_size: int, ttl: float, db_path: Optional[str] = None):
+        self.max_size = max_size
+        self.max_disk_size = max_size * 10
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (time, value)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        if db_path:
+            self.connection = sqlite3.connect(db_path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, created_at REAL NOT NULL, value TEXT NOT NULL)"
+            )
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None and self.connection is not None:
+                row = self.connection.execute(
+                    "SELECT created_at, value FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = (row[0], json.loads(row[1]))
+                    self._remember(key, entry)
+            if entry is None or now - entry[0] > self.ttl:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+            if self.connection is not None:
+                with self.connection:
+                    self.connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def record(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def set(self, key: str, value) -> None:
+        entry = (time.time(), value)
+        with self.lock:
+            self._remember(key, entry)
+            if self.connection is not None:
+                with self.connection:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO cache (key, created_at, value) "
+                        "VALUES (?, ?, ?)",
+                        (key, entry[0], json.dumps(value)),
+                    )
+                    # Keep the disk tier bounded too, oldest entries go first
+                    self.connection.execute(
+                        "DELETE FROM cache WHERE created_at < ? OR key NOT IN "
+                        "(SELECT key FROM cache ORDER BY created_at DESC LIMIT ?)",
+                        (entry[0] - self.ttl, self.max_disk_size),
+                    )
+
+    def _remember(self, key: str, entry: tuple) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+vision_cache = ResultCache(VISION_CACHE_SIZE, VISION_CACHE_TTL, VISION_CACHE_DB_PATH)
+media_index = ResultCache(MEDIA_INDEX_SIZE, MEDIA_INDEX_TTL, MEDIA_INDEX_DB_PATH)
+
+
+# Reuse what was derived from a media file before, so it is not even downloaded
+async def get_media_artifact(kind: str, file_unique_id: str, produce):
+    key = f"{kind}:{file_unique_id}"
+    artifact = media_index.get(key)
+    media_index.record(artifact is not None)
+    if artifact is None:
+        artifact = await produce()
+        media_index.set(key, artifact)
+    else:
+        print(f"Media index hit for {kind} (hit rate {media_index.hit_rate:.0%})")
+    return artifact
+
+
+def image_digest(image: Image.Image) -> str:
+    digest = hashlib.sha256(image.tobytes())
+    digest.update(f"{image.mode}{image.size}".encode())
+    return digest.hexdigest()
+
+
+# Run a vision call unless the file_unique_id, then the pixels, were seen before
+async def cached_vision_call(
+    kind: str, image: Image.Image, call, file_unique_id: Optional[str] = None
+) -> str:
+    keys = [f"{kind}:file:{file_unique_id}"] if file_unique_id else []
+    result = vision_cache.get(keys[0]) if keys else None
+    if result is None:
+        keys.append(f"{kind}:sha256:{image_digest(image)}")
+        result = vision_cache.get(keys[-1])
+    vision_cache.record(result is not None)
+
+    if result is None:
+        result = await call()
+        new_keys = keys
+    else:
+        print(f"Vision cache hit (hit rate {vision_cache.hit_rate:.0%})")
+        new_keys = keys[:-1] if len(keys) == 2 else []
+    for key in new_keys:
+        vision_cache.set(key, result)
+    return result
+
+
 # Handle /start command
 async def start(update: Update, context: CallbackContext) -> None:
     keyboard = [
@@ -540,107 +1336,637 @@ async def language_callback(update: Update, context: CallbackContext) -> None:
     context.user_data["config_step"] = "name"
 
 
-# Add new function to process conversation screenshots
-async def process_conversation(update: Update, context: CallbackContext):
-    user_id = update.effective_user.id
+def style_index_path(user_id: int) -> str:
+    return os.path.join(STYLE_INDEX_DIR, str(user_id))
+
+
+def remember_style_index(user_id: int, vector_store: FAISS) -> None:
+    conversation_stores[user_id] = vector_store
+    conversation_stores.move_to_end(user_id)
+    while len(conversation_stores) > MAX_RESIDENT_STYLE_INDEXES:
+        conversation_stores.popitem(last=False)
+
+
+# Load the user's vector store on first use, None if they never sent any
+async def get_style_index(user_id: int) -> Optional[FAISS]:
+    if user_id in conversation_stores:
+        conversation_stores.move_to_end(user_id)
+        return conversation_stores[user_id]
+    path = style_index_path(user_id)
+    recover_style_index(path)
+    if not os.path.isdir(path):
+        return None
+    # The files are written by this bot only, so unpickling them is safe
+    vector_store = await to_thread(
+        FAISS.load_local, path, embeddings, allow_dangerous_deserialization=True
+    )
+    remember_style_index(user_id, vector_store)
+    return vector_store
+
+
+# Finish or undo a swap that a crash interrupted, so the index is never lost
+def recover_style_index(path: str) -> None:
+    if not os.path.isdir(path):
+        # The old index is only moved aside once the new one is fully written
+        if os.path.isdir(f"{path}.old") and os.path.isdir(f"{path}.tmp"):
+            os.rename(f"{path}.tmp", path)
+            print(f"Recovered the new style index at {path}")
+        elif os.path.isdir(f"{path}.old"):
+            os.rename(f"{path}.old", path)
+            print(f"Recovered the previous style index at {path}")
+    # A crash after the swap leaves the previous index behind, which would block
+    # the next rename
+    shutil.rmtree(f"{path}.old", ignore_errors=True)
+
+
+# Write the index next to the old one and swap, so a crash never leaves half a file
+def save_style_index(user_id: int, vector_store: FAISS) -> None:
+    path = style_index_path(user_id)
+    recover_style_index(path)
+    shutil.rmtree(f"{path}.tmp", ignore_errors=True)  # Left by a crashed write
+    vector_store.save_local(f"{path}.tmp")
+    if os.path.isdir(path):
+        os.rename(path, f"{path}.old")
+    os.rename(f"{path}.tmp", path)
+    shutil.rmtree(f"{path}.old", ignore_errors=True)
+
+
+# Embed new chunks into the user's vector store and persist it
+async def add_to_style_index(user_id: int, texts: List[str]) -> None:
+    vector_store = await get_style_index(user_id)
+    embedding_tokens = sum(estimate_tokens(text) for text in texts)
+    if vector_store is None:
+        vector_store = await call_openai(
+            "embeddings",
+            lambda: to_thread(FAISS.from_texts, texts, embeddings),
+            tokens=embedding_tokens,
+        )
+    else:
+        await call_openai(
+            "embeddings",
+            lambda: to_thread(vector_store.add_texts, texts),
+            tokens=embedding_tokens,
+        )
+    await to_thread(save_style_index, user_id, vector_store)
+    remember_style_index(user_id, vector_store)
+
+    # The digest no longer covers everything the user taught, write it again
+    style_index_versions[user_id] = style_index_versions.get(user_id, 0) + 1
+    style_digests.pop(user_id, None)
+    if os.path.exists(style_digest_path(user_id)):
+        os.remove(style_digest_path(user_id))
+
+
+def style_digest_path(user_id: int) -> str:
+    return os.path.join(STYLE_INDEX_DIR, f"{user_id}.digest.txt")
+
+
+# Summarize the user's style once from their latest chunks and keep it on disk
+async def refresh_style_digest(user_id: int, vector_store: FAISS) -> None:
+    version = style_index_versions.get(user_id, 0)
+    # This runs in its own task, so the lower priority only applies here
+    request_priority.set(PRIORITY_BACKGROUND)
+    try:
+        ids = list(vector_store.index_to_docstore_id.values())[-STYLE_DIGEST_SAMPLE:]
+        samples = "\n---\n".join(
+            vector_store.docstore.search(i).page_content for i in ids
+        )
+        digest_prompt = f"""These are conversations written by one person:
+        {samples}
+
+        Describe how this person texts in under 80 words: tone, vocabulary, emoji, punctuation and message length. Then quote 3 short lines that are typical of them."""
+
+        response = await call_openai(
+            "chat",
+            lambda: client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": digest_prompt}],
+                temperature=0.3,
+                max_tokens=200,
+            ),
+            tokens=estimate_tokens(digest_prompt) + 200,
+        )
+        digest = response.choices[0].message.content
+        # New screenshots were learned meanwhile, the next turn starts a fresh one
+        if style_index_versions.get(user_id, 0) != version:
+            return
+        with open(style_digest_path(user_id), "w", encoding="utf-8") as f:
+            f.write(digest)
+    except Exception as e:
+        print(f"Error refreshing style digest: {e}")
+        digest_retry_at[user_id] = time.monotonic() + STYLE_DIGEST_RETRY_DELAY
+        return
+
+    digest_retry_at.pop(user_id, None)
+    style_digests[user_id] = digest
+    print(f"Style digest written for user {user_id}")
+
+
+def style_profile_path(user_id: int) -> str:
+    return os.path.join(STYLE_INDEX_DIR, f"{user_id}.profile.json")
+
+
+# The user's style profile, read from disk once and then kept in their config
+def get_style_profile(user_id: int) -> Optional[dict]:
+    if user_id not in user_configs:
+        user_configs[user_id] = DEFAULT_CONFIG.copy()
+    config = user_configs[user_id]
+    if "style_profile" not in config:
+        config["style_profile"] = None
+        path = style_profile_path(user_id)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                config["style_profile"] = json.load(f)
+    return config["style_profile"]
+
+
+# Lines the user wrote, or every message line when the OCR did not mark them
+def own_message_lines(conversation_text: str) -> List[str]:
+    lines = []
+    for line in conversation_text.splitlines():
+        line = line.replace("**", "").strip().lstrip("-•* ").strip()
+        if line:
+            lines.append(line)
+    own = [line[3:].strip() for line in lines if line.lower().startswith("me:")]
+    if own:
+        return [line for line in own if line]
+    lines = [re.sub(r"^[^:]{1,30}:\s*", "", line) for line in lines]
+    return [line for line in lines if line]
+
+
+# Fold a screenshot's messages into the running counts of the profile
+def update_style_profile(profile: Optional[dict], lines: List[str]) -> dict:
+    profile = profile or {
+        "messages": 0,
+        "characters": 0,
+        "length_buckets": [0] * (len(MESSAGE_LENGTH_BUCKETS) + 1),
+        "emoji_messages": 0,
+        "emoji": 0,
+        "punctuation": {"!": 0, "?": 0, "...": 0, "final_period": 0},
+        "lowercase_starts": 0,
+        "words": {},
+        "samples": [],
+    }
+    words = Counter(profile["words"])
+    for line in lines:
+        profile["messages"] += 1
+        profile["characters"] += len(line)
+        bucket = sum(len(line) > bound for bound in MESSAGE_LENGTH_BUCKETS)
+        profile["length_buckets"][bucket] += 1
+        emoji = len(EMOJI_PATTERN.findall(line))
+        profile["emoji"] += emoji
+        profile["emoji_messages"] += emoji > 0
+        for mark in ("!", "?", "..."):
+            profile["punctuation"][mark] += mark in line
+        final_period = line.endswith(".") and not line.endswith("...")
+        profile["punctuation"]["final_period"] += final_period
+        profile["lowercase_starts"] += line[0].islower()
+        words.update(word.lower() for word in WORD_PATTERN.findall(line))
+        if 10 <= len(line) <= 120:
+            profile["samples"] = (profile["samples"] + [line])[-STYLE_PROFILE_SAMPLES:]
+    profile["words"] = dict(words.most_common(STYLE_PROFILE_WORDS))
+    profile["summary"] = describe_style_profile(profile)
+    return profile
+
+
+# Render the profile as the short text given to the model at reply time
+def describe_style_profile(profile: dict) -> str:
+    count = max(profile["messages"], 1)
+    buckets = profile["length_buckets"]
+    bounds = [0] + MESSAGE_LENGTH_BUCKETS
+    typical = buckets.index(max(buckets))
+    length = (
+        f"{bounds[typical]}-{bounds[typical + 1]} characters"
+        if typical < len(MESSAGE_LENGTH_BUCKETS)
+        else f"over {bounds[typical]} characters"
+    )
+    punctuation = ", ".join(
+        f"{mark} in {profile['punctuation'][mark] / count:.0%}"
+        for mark in ("!", "?", "...")
+    )
+    favourite = [word for word in profile["words"] if word not in COMMON_WORDS]
+    samples = "\n".join(f"- {line}" for line in profile["samples"])
+    return (
+        f"Style profile from {profile['messages']} of the user's messages: "
+        f"usually {length} (average {profile['characters'] / count:.0f}); "
+        f"emoji in {profile['emoji_messages'] / count:.0%} of messages; "
+        f"{punctuation}; ends with a period in "
+        f"{profile['punctuation']['final_period'] / count:.0%}; starts lowercase in "
+        f"{profile['lowercase_starts'] / count:.0%}. "
+        f"Favourite words: {', '.join(favourite[:STYLE_PROFILE_TOP_WORDS])}.\n"
+        f"Sample lines:\n{samples}"
+    )
+
+
+# Update and persist the profile with the messages of a new screenshot
+def learn_style_profile(user_id: int, conversation_text: str) -> None:
+    lines = own_message_lines(conversation_text)
+    if not lines:
+        return
+    profile = update_style_profile(get_style_profile(user_id), lines)
+    user_configs[user_id]["style_profile"] = profile
+    path = style_profile_path(user_id)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+
+# The cached style digest, from memory or disk, None until it is written
+def get_style_digest(user_id: int) -> Optional[str]:
+    if user_id not in style_digests:
+        path = style_digest_path(user_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            style_digests[user_id] = f.read()
+    return style_digests[user_id]
+
+
+# Style context for a turn: the profile and digest, retrieved examples if enabled
+async def get_style_context(user_id: int, user_message: str) -> Optional[str]:
+    parts = []
+    profile = get_style_profile(user_id)
+    if profile is not None:
+        parts.append(profile["summary"])
+    digest = get_style_digest(user_id)
+    if digest is not None:
+        parts.append(digest)
+    # The index is only needed to write the digest or to retrieve examples
+    if digest is not None and not STYLE_RETRIEVAL:
+        return "\n".join(parts)
+
+    vector_store = await get_style_index(user_id)
+    if vector_store is None:
+        return "\n".join(parts) or None
+    task = digest_tasks.get(user_id)
+    retry_due = time.monotonic() >= digest_retry_at.get(user_id, 0.0)
+    if digest is None and (task is None or task.done()) and retry_due:
+        digest_tasks[user_id] = create_task(refresh_style_digest(user_id, vector_store))
+    if parts and not STYLE_RETRIEVAL:
+        return "\n".join(parts)
+    docs = await call_openai(
+        "embeddings",
+        lambda: to_thread(
+            vector_store.similarity_search, user_message, k=STYLE_EXAMPLES
+        ),
+        tokens=estimate_tokens(user_message),
+    )
+    examples = "\n".join(doc.page_content for doc in docs)
+    parts.append(f"Examples of how the user writes:\n{examples}")
+    return "\n".join(parts)
+
+
+# Log the average reply latency of each style mode for users with a style index
+def record_style_latency(mode: str, latency: float) -> None:
+    stats = style_stats[mode]
+    stats["replies"] += 1
+    stats["total_latency"] += latency
+    print(
+        f"Styled reply in {latency:.2f} s ({mode}); averages: "
+        + ", ".join(
+            f"{name} {value['total_latency'] / value['replies']:.2f} s "
+            f"over {value['replies']}"
+            for name, value in style_stats.items()
+            if value["replies"]
+        )
+    )
+
+
+os.makedirs(STYLE_INDEX_DIR, exist_ok=True)
+
+
+# Read the conversation in a screenshot, reusing earlier OCR of the same file
+async def read_conversation(update: Update, stats: Optional[dict] = None) -> str:
     photo = update.message.photo[-1]
-    file = await photo.get_file()
-    file_content = await file.download_as_bytearray()
 
     # Extract text from image
-    image = Image.open(io.BytesIO(file_content)).convert("RGB")
-    conversation_text = await extract_text_from_image(image)
+    async def produce() -> str:
+        if stats is not None:
+            stats["ocr_calls"] += 1
+        file = await photo.get_file()
+        file_content = await file.download_as_bytearray()
+        image = Image.open(io.BytesIO(file_content)).convert("RGB")
+        return await extract_text_from_image(image, photo.file_unique_id)
+
+    return await get_media_artifact("ocr", photo.file_unique_id, produce)
 
+
+# Embed the chunks of all conversations in one batch and update the style profile
+async def learn_conversations(user_id: int, conversation_texts: List[str]) -> None:
     # Split text into chunks
     text_splitter = CharacterTextSplitter(
         separator="\n", chunk_size=1000, chunk_overlap=200, length_function=len
     )
-    texts = text_splitter.split_text(conversation_text)
+    texts = [
+        chunk
+        for conversation_text in conversation_texts
+        for chunk in text_splitter.split_text(conversation_text)
+    ]
 
-    # Create or update user's vector store
-    if user_id not in conversation_stores:
-        conversation_stores[user_id] = FAISS.from_texts(texts, embeddings)
-    else:
-        conversation_stores[user_id].add_texts(texts)
+    # Create or update user's vector store and style profile
+    await add_to_style_index(user_id, texts)
+    learn_style_profile(user_id, "\n".join(conversation_texts))
 
+
+# Add new function to process conversation screenshots
+async def process_conversation(update: Update, context: CallbackContext):
+    user_id = update.effective_user.id
+    conversation_text = await read_conversation(update)
+    await learn_conversations(user_id, [conversation_text])
     await update.message.reply_text(get_message(user_id, "processed_conversation"))
 
 
-async def extract_text_from_image(image: Image.Image) -> str:
-    # Similar to describe_image but focused on extracting conversation text
-    base64_image = encode_image_from_pil(image)
+# Learn from a whole album: concurrent OCR, one embedding batch, one confirmation
+async def process_conversation_album(
+    updates: List[Update], context: CallbackContext
+) -> None:
+    user_id = updates[0].effective_user.id
+    stats = {"ocr_calls": 0}
+    semaphore = Semaphore(LEARN_OCR_CONCURRENCY)
 
-    response = await client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": "Extract the conversation text from this screenshot. Format it as a clear dialogue.",
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}",
-                            "detail": "high",
-                        },
-                    },
-                ],
-            }
-        ],
-        max_tokens=500,
+    async def read(update: Update) -> str:
+        async with semaphore:
+            return await read_conversation(update, stats)
+
+    results = await gather(
+        *(read(update) for update in updates), return_exceptions=True
     )
-    return response.choices[0].message.content
+    conversation_texts = []
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Error reading album screenshot: {result}")
+        else:
+            conversation_texts.append(result)
+    if not conversation_texts:
+        raise RuntimeError("No screenshot of the album could be read")
 
+    await learn_conversations(user_id, conversation_texts)
+    await updates[0].message.reply_text(
+        get_message(user_id, "processed_album", count=len(conversation_texts))
+    )
+    print(
+        f"Learned album of {len(updates)} screenshots: {stats['ocr_calls']} OCR "
+        f"call(s), 1 embedding batch, 1 reply"
+    )
+
+
+# Photos sent as part of an album
+class MediaGroupFilter(filters.MessageFilter):
+    def filter(self, message) -> bool:
+        return message.media_group_id is not None
+
+
+# Collect the photos of an album until no more arrive
+async def collect_album_photo(update: Update, context: CallbackContext) -> None:
+    media_group_id = update.message.media_group_id
+    pending_albums.setdefault(media_group_id, []).append(update)
+
+    # Restart the wait if the album is still arriving
+    if media_group_id in album_tasks and not album_tasks[media_group_id].done():
+        album_tasks[media_group_id].cancel()
+    album_tasks[media_group_id] = create_task(
+        process_album_with_delay(media_group_id, context)
+    )
+
+
+async def process_album_with_delay(
+    media_group_id: str, context: CallbackContext
+) -> None:
+    await sleep(ALBUM_COLLECT_DELAY)
 
-def encode_image_from_pil(image: Image.Image) -> str:
+    # From here on the album is queued and must not be cancelled
+    album_tasks.pop(media_group_id, None)
+    updates = sorted(
+        pending_albums.pop(media_group_id, []), key=lambda u: u.message.message_id
+    )
+    if not updates:
+        return
+
+    # Only the first photo of an album carries the caption. The whole album is one
+    # scheduler job, so it counts once against the per-user queue cap.
+    if any(update.message.caption == "learn" for update in updates):
+        album_handler = process_conversation_album
+    else:
+        album_handler = process_photo_album
+    handler = serialized(
+        lambda update, context: album_handler(updates, context), PRIORITY_MEDIA
+    )
+    await handler(updates[0], context)
+
+
+# Answer each photo of an ordinary album in turn
+async def process_photo_album(updates: List[Update], context: CallbackContext) -> None:
+    for update in updates:
+        try:
+            await process_photo(update, context)
+        except Exception as e:
+            print(f"Error processing album photo: {e}")
+
+
+async def extract_text_from_image(
+    image: Image.Image, file_unique_id: Optional[str] = None
+) -> str:
+    async def call() -> str:
+        # Similar to describe_image but focused on extracting conversation text
+        base64_image = encode_image_from_pil(image, detail="high")
+
+        response = await call_openai(
+            "vision",
+            lambda: client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": "Extract the conversation text from this screenshot. Format it as a clear dialogue, one message per line, and prefix the messages sent by the screenshot owner (on the right side) with 'Me:'.",
+                            },
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/jpeg;base64,{base64_image}",
+                                    "detail": "high",
+                                },
+                            },
+                        ],
+                    }
+                ],
+                max_tokens=500,
+            ),
+            tokens=VISION_TOKENS["high"] + 500,
+        )
+        return response.choices[0].message.content
+
+    return await cached_vision_call("ocr", image, call, file_unique_id)
+
+
+# Largest size the vision model actually looks at for each detail level
+VISION_MAX_SIZE = {"low": (512, 512), "high": (2048, 2048)}
+VISION_HIGH_SHORT_SIDE = 768
+VISION_TOKENS = {"low": 85, "high": 765}  # Image tokens billed per detail level
+JPEG_QUALITY = int(os.environ.get("JPEG_QUALITY", 85))
+
+
+# Downscale to the model's effective resolution and encode as JPEG in memory
+def encode_image_from_pil(
+    image: Image.Image, detail: str = "low", quality: int = JPEG_QUALITY
+) -> str:
+    max_width, max_height = VISION_MAX_SIZE[detail]
+    scale = min(1.0, max_width / image.width, max_height / image.height)
+    if detail == "high":
+        scale = min(scale, VISION_HIGH_SHORT_SIDE / min(image.size))
+    # One resize to the final size, shrinking by whole factors first for speed
+    if scale < 1.0:
+        image = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+            Image.Resampling.LANCZOS,
+            reducing_gap=3.0,
+        )
     buffered = io.BytesIO()
-    image.save(buffered, format="JPEG")
+    image.save(buffered, format="JPEG", quality=quality, optimize=True)
     return base64.b64encode(buffered.getvalue()).decode("utf-8")
 
 
-# Modify handle_message to check for typing status
+# Queue a job behind the user's other work, or tell them we're busy
+async def submit_work(update: Update, job: Callable[[], Awaitable[None]]) -> bool:
+    user_id = update.effective_user.id
+    queue = user_queues.setdefault(user_id, deque())
+    if len(queue) >= MAX_USER_QUEUE:
+        print(f"Queue full for {user_id}, {len(queue)} jobs waiting")
+        await update.effective_message.reply_text(get_message(user_id, "busy"))
+        return False
+
+    queue.append((time.monotonic(), job))
+    scheduler_stats["queue_depth"] += 1
+    if user_id not in running_users and user_id not in ready_users:
+        ready_users.append(user_id)
+        work_available.set()
+    return True
+
+
+# Run handlers through the scheduler so each user's work stays in order
+def serialized(handler, priority: int = PRIORITY_TEXT):
+    async def wrapper(update: Update, context: CallbackContext) -> None:
+        async def job() -> None:
+            # OpenAI calls made by the handler use its priority lane
+            token = request_priority.set(priority)
+            try:
+                await handler(update, context)
+            finally:
+                request_priority.reset(token)
+
+        await submit_work(update, job)
+
+    return wrapper
+
+
+async def scheduler_worker() -> None:
+    while True:
+        while not ready_users:
+            work_available.clear()
+            await work_available.wait()
+
+        # Take the next user in line, one job at a time per user
+        user_id = ready_users.popleft()
+        queue = user_queues[user_id]
+        enqueued_at, job = queue.popleft()
+        running_users.add(user_id)
+
+        wait = time.monotonic() - enqueued_at
+        scheduler_stats["queue_depth"] -= 1
+        scheduler_stats["jobs"] += 1
+        scheduler_stats["total_wait"] += wait
+        scheduler_stats["max_wait"] = max(scheduler_stats["max_wait"], wait)
+        print(
+            f"Running job for {user_id} after {wait:.2f} s in queue "
+            f"(queue depth {scheduler_stats['queue_depth']})"
+        )
+
+        try:
+            await job()
+        except Exception as e:
+            print(f"Error running job for {user_id}: {e}")
+        finally:
+            running_users.discard(user_id)
+            # Back of the line so other users get their turn first
+            if queue:
+                ready_users.append(user_id)
+                work_available.set()
+            else:
+                del user_queues[user_id]
+
+
+async def start_scheduler(application) -> None:
+    for _ in range(SCHEDULER_WORKERS):
+        create_task(scheduler_worker())
+
+
+# Wait about as long as the user's usual gap between messages, within limits
+def debounce_delay(user_id: int, now: float) -> float:
+    delay = message_gaps.get(user_id, DEBOUNCE_MIN_DELAY) * 1.5
+    delay = min(max(delay, DEBOUNCE_MIN_DELAY), DEBOUNCE_DELAY)
+    remaining = burst_started[user_id] + DEBOUNCE_MAX_WAIT - now
+    return max(min(delay, remaining), 0)
+
+
+# Buffer the user's messages and answer the whole burst in one call
 async def handle_message(update: Update, context: CallbackContext) -> None:
     print("Handling message...")
     user_id = update.message.from_user.id
+    now = time.monotonic()
 
-    # Cancel any existing typing task for this user
-    if user_id in typing_tasks and not typing_tasks[user_id].done():
-        typing_tasks[user_id].cancel()
+    # Learn the user's typing pace from gaps between messages of the same burst
+    last_message_time = context.user_data.get("last_message_time")
+    if last_message_time is not None and now - last_message_time < DEBOUNCE_MAX_WAIT:
+        gap = now - last_message_time
+        message_gaps[user_id] = 0.5 * gap + 0.5 * message_gaps.get(user_id, gap)
+    context.user_data["last_message_time"] = now
 
-    # Check if the user is typing by looking at the message timestamp
-    current_time = update.message.date.timestamp()
-    last_message_time = context.user_data.get("last_message_time", 0)
-    time_diff = current_time - last_message_time
+    pending_messages.setdefault(user_id, []).append(update.message.text)
+    burst_started.setdefault(user_id, now)
 
-    # If messages are less than 2 seconds apart, consider the user still typing
-    if time_diff < 2:
-        # Create a new typing task with delay
-        typing_tasks[user_id] = create_task(
-            process_message_with_delay(update, context, DEBOUNCE_DELAY)
-        )
-    else:
-        # Process immediately if user is not actively typing
-        typing_tasks[user_id] = create_task(
-            process_message_with_delay(update, context, 0)
-        )
+    # Restart the wait if the burst is still being collected
+    if user_id in typing_tasks and not typing_tasks[user_id].done():
+        typing_tasks[user_id].cancel()
 
-    # Update last message time
-    context.user_data["last_message_time"] = current_time
+    # Setup answers (like the user's name) don't need to wait for more messages
+    delay = 0 if "config_step" in context.user_data else debounce_delay(user_id, now)
+    typing_tasks[user_id] = create_task(
+        process_message_with_delay(update, context, delay)
+    )
 
 
 async def process_message_with_delay(
     update: Update, context: CallbackContext, delay: float
 ) -> None:
     print("Processing message with delay...")
-    try:
-        # Wait for the specified delay
-        await sleep(delay)
+    # Wait for the specified delay
+    await sleep(delay)
 
+    # From here on the burst is queued and must not be cancelled
+    user_id = update.message.from_user.id
+    typing_tasks.pop(user_id, None)
+    burst_started.pop(user_id, None)
+    messages = pending_messages.pop(user_id, [])
+    if not messages:
+        return
+    user_message = "\n".join(messages)
+
+    debounce_stats["messages"] += len(messages)
+    debounce_stats["calls"] += 1
+    print(
+        f"Answering {len(messages)} message(s) in one call "
+        f"({debounce_stats['messages'] - debounce_stats['calls']} calls saved)"
+    )
+    await submit_work(update, lambda: answer_messages(update, context, user_message))
+
+
+async def answer_messages(
+    update: Update, context: CallbackContext, user_message: str
+) -> None:
+    try:
         user_id = update.message.from_user.id
-        user_message = update.message.text
 
         # Continue with the existing message handling logic
         if "config_step" in context.user_data:
@@ -670,20 +1996,31 @@ async def process_message_with_delay(
 
         user_language = user_languages.get(user_id, "en")
         config = {"configurable": {"session_id": user_id, "language": user_language}}
+        started = time.perf_counter()
+
+        style_context = None
+        if STYLE_MODE == "inline":
+            # Fetch the style context while the session history loads
+            history = get_session_history(user_id)
+            style_context, _ = await gather(
+                get_style_context(user_id, user_message),
+                to_thread(lambda: history.messages),
+            )
+            config["configurable"]["style_context"] = style_context
 
-        session_history = await get_session_history(user_id)
-        with_message_history = RunnableWithMessageHistory(
-            chain, lambda: session_history
-        )
-        initial_response = with_message_history.invoke(
+        response_text, reply, shown_text = await stream_reply(
+            update,
+            context,
             [HumanMessage(content=f"[LANGUAGE: {user_language}] {user_message}")],
-            config=config,
+            config,
         )
 
         # If the response contains a suggested message and user has conversation history,
         # enhance that specific part with the user's style
-        response_text = initial_response.content
-        if user_id in conversation_stores and "you should say" in response_text.lower():
+        style_store = None
+        if STYLE_MODE == "rewrite":
+            style_store = await get_style_index(user_id)
+        if style_store is not None and "you should say" in response_text.lower():
             # Split the response into context and suggestion
             parts = response_text.split("you should say", 1)
             if len(parts) == 2:
@@ -691,7 +2028,11 @@ async def process_message_with_delay(
                 suggestion = parts[1]
 
                 # Get similar conversation examples for style reference
-                docs = conversation_stores[user_id].similarity_search(suggestion, k=2)
+                docs = await call_openai(
+                    "embeddings",
+                    lambda: to_thread(style_store.similarity_search, suggestion, k=2),
+                    tokens=estimate_tokens(suggestion),
+                )
                 style_examples = "\n".join([doc.page_content for doc in docs])
 
                 # Generate a style-matched version of the suggestion
@@ -702,107 +2043,303 @@ async def process_message_with_delay(
                 
                 Keep the same meaning but adapt the tone, vocabulary, and punctuation to match how they typically write."""
 
-                style_response = await client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[{"role": "user", "content": style_prompt}],
-                    temperature=0.7,
+                style_response = await call_openai(
+                    "chat",
+                    lambda: client.chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=[{"role": "user", "content": style_prompt}],
+                        temperature=0.7,
+                    ),
+                    tokens=estimate_tokens(style_prompt) + 200,
                 )
 
                 styled_suggestion = style_response.choices[0].message.content
                 response_text = f"{context}you should say{styled_suggestion}"
 
-        await update.message.reply_text(response_text)
+        # Every reply to a user with a style index is timed, in both modes
+        if style_context is not None or style_store is not None:
+            record_style_latency(STYLE_MODE, time.perf_counter() - started)
+
+        # Send the final text, unless the streamed message already shows it
+        if reply is not None and response_text != shown_text:
+            try:
+                await reply.edit_text(response_text)
+            except TelegramError as e:
+                # Telegram strips whitespace, so the edit may change nothing visible
+                if "not modified" in str(e):
+                    return
+                print(f"Final edit failed, sending the reply instead: {e}")
+                reply = None
+        if reply is None:
+            await update.message.reply_text(response_text)
 
     except Exception as e:
         print(f"Error processing message: {e}")
 
 
+# Show "typing..." until the reply is complete
+async def keep_typing(context: CallbackContext, chat_id: int) -> None:
+    while True:
+        await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+        await sleep(TYPING_HEARTBEAT_INTERVAL)
+
+
+# Stream the chain's reply into a Telegram message, edited as tokens arrive
+async def stream_reply(
+    update: Update, context: CallbackContext, messages: list, config: dict
+):
+    started = time.perf_counter()
+    state = {"reply": None, "shown": ""}  # Kept across retries of the stream
+
+    async def stream() -> str:
+        text = ""
+        last_edit = 0.0
+        async for chunk in chain_with_history.astream(messages, config=config):
+            text += chunk.content
+            if not STREAM_REPLIES or not text.strip():
+                continue
+            now = time.monotonic()
+            if now - last_edit < STREAM_EDIT_INTERVAL or text == state["shown"]:
+                continue
+            last_edit = now
+            try:
+                if state["reply"] is None:
+                    state["reply"] = await update.message.reply_text(text)
+                    first_token = time.perf_counter() - started
+                    streaming_stats["replies"] += 1
+                    streaming_stats["total_first_token"] += first_token
+                    print(f"First visible token after {first_token:.2f} s")
+                else:
+                    await state["reply"].edit_text(text)
+            except TelegramError as e:
+                # Flood control or an unchanged edit: the next interval tries again
+                print(f"Streamed update failed, still streaming: {e}")
+                continue
+            state["shown"] = text
+        return text
+
+    typing = create_task(keep_typing(context, update.effective_chat.id))
+    try:
+        text = await call_openai(
+            "chat",
+            stream,
+            tokens=HISTORY_TOKEN_BUDGET + count_tokens(messages) + 1500,
+        )
+    finally:
+        typing.cancel()
+    return text, state["reply"], state["shown"]
+
+
 # Generate a response for a given message
 async def generate_response(user_id, user_message) -> str:
     print("Generating response...")
     config = {"configurable": {"session_id": user_id}}
-    session_history = await get_session_history(user_id)
-    with_message_history = RunnableWithMessageHistory(chain, lambda: session_history)
-    response = with_message_history.invoke(
-        [HumanMessage(content=user_message)], config=config
+    response = await call_openai(
+        "chat",
+        lambda: chain_with_history.ainvoke(
+            [HumanMessage(content=user_message)], config=config
+        ),
+        tokens=HISTORY_TOKEN_BUDGET + estimate_tokens(user_message) + 1500,
     )
     return response.content
 
 
-# Convert speech to text
-async def speech_to_text_conversion(file_path):
-    with open(file_path, "rb") as file_like:
-        transcription = await client.audio.transcriptions.create(
-            model="whisper-1", file=file_like
-        )
-    return transcription.text
-
-
-async def text_to_speech_conversion(text) -> str:
-    client_oa = OpenAI(api_key=openai_api_key)
-    # Generate a unique ID for temporary file names
-    unique_id = uuid.uuid4().hex
-    mp3_path = f"{unique_id}.mp3"  # Path for temporary MP3 file
-    ogg_path = f"{unique_id}.ogg"  # Path for final OGG file
+# Audio MIME types Whisper accepts as-is, with the extension it expects
+WHISPER_AUDIO_FORMATS = {
+    "audio/ogg": "ogg",
+    "audio/opus": "ogg",
+    "audio/mpeg": "mp3",
+    "audio/mp4": "m4a",
+    "audio/x-m4a": "m4a",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/webm": "webm",
+    "audio/flac": "flac",
+}
 
-    # Convert the input text to speech and save it as an MP3 file
-    with client_oa.audio.speech.with_streaming_response.create(
-        model="tts-1",  # Use the text-to-speech model
-        voice="nova",  # Specify the voice model to use
-        input=text,  # Text to convert to speech
-    ) as response:
-        # Write the streamed audio data to the MP3 file
-        with open(mp3_path, "wb") as f:
-            for chunk in response.iter_bytes():
-                f.write(chunk)
 
-    # Convert the MP3 file to OGG format with OPUS codec using ffmpeg
-    ffmpeg.input(mp3_path).output(ogg_path, codec="libopus").run(overwrite_output=True)
+# Convert speech to text
+async def speech_to_text_conversion(audio: bytes, filename: str) -> str:
+    transcription = await call_openai(
+        "whisper",
+        lambda: client.audio.transcriptions.create(
+            model="whisper-1", file=(filename, audio)
+        ),
+    )
+    return transcription.text
 
-    # Remove the temporary MP3 file as it is no longer needed
-    os.remove(mp3_path)
 
-    # Return the path to the final OGG file
-    return ogg_path
+# Output options for compact speech audio: 16 kHz mono Opus in Ogg, to stdout
+FFMPEG_SPEECH_OUTPUT = [
+    "-vn",
+    "-ac",
+    "1",
+    "-ar",
+    "16000",
+    "-c:a",
+    "libopus",
+    "-b:a",
+    "24k",
+    "-f",
+    "ogg",
+    "pipe:1",
+]
+
+
+# Run ffmpeg/ffprobe without blocking the event loop and return its stdout
+async def run_ffmpeg(program: str, *args: str, data: Optional[bytes] = None) -> bytes:
+    process = await create_subprocess_exec(
+        program,
+        "-loglevel",
+        "error",
+        *args,
+        stdin=PIPE if data is not None else None,
+        stdout=PIPE,
+        stderr=PIPE,
+    )
+    stdout, stderr = await process.communicate(data)
+    if process.returncode != 0:
+        raise RuntimeError(f"{program} failed: {stderr.decode(errors='ignore')}")
+    return stdout
+
+
+# Transcode audio to compact speech audio through an ffmpeg pipe, without temp files
+async def transcode_audio(audio: bytes) -> bytes:
+    return await run_ffmpeg("ffmpeg", "-i", "pipe:0", *FFMPEG_SPEECH_OUTPUT, data=audio)
+
+
+# Transcribe in-memory audio, transcoding only when Whisper rejects the format
+async def transcribe_audio(audio: bytes, mime_type: Optional[str]) -> str:
+    extension = WHISPER_AUDIO_FORMATS.get(mime_type)
+    if extension is not None:
+        try:
+            return await speech_to_text_conversion(audio, f"audio.{extension}")
+        except BadRequestError as e:
+            print(f"Transcription rejected the original audio, transcoding: {e}")
+    return await speech_to_text_conversion(await transcode_audio(audio), "audio.ogg")
+
+
+# Synthesize speech as Ogg/Opus in memory, ready to send as a Telegram voice note
+async def text_to_speech_conversion(text) -> bytes:
+    async def stream() -> bytes:
+        started = time.perf_counter()
+        first_byte_ms = None
+        buffer = io.BytesIO()
+
+        # Stream the audio from the shared async client
+        async with client.audio.speech.with_streaming_response.create(
+            model=TTS_MODEL,  # Use the text-to-speech model
+            voice=TTS_VOICE,  # Specify the voice model to use
+            input=text,  # Text to convert to speech
+            response_format="opus",  # Telegram voice notes are Ogg/Opus
+        ) as response:
+            async for chunk in response.iter_bytes():
+                if first_byte_ms is None:
+                    first_byte_ms = (time.perf_counter() - started) * 1000
+                buffer.write(chunk)
+
+        total_ms = (time.perf_counter() - started) * 1000
+        print(f"TTS first byte: {first_byte_ms or 0:.0f} ms, total: {total_ms:.0f} ms")
+        return buffer.getvalue()
+
+    return await call_openai("tts", stream)
 
 
 # Process voice message
 async def process_voice_message(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
 
-    # Download and save the voice message
-    file = await update.message.voice.get_file()
-    file_bytearray = await file.download_as_bytearray()
-    with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp_ogg:
-        temp_ogg.write(file_bytearray)
-        temp_ogg_path = temp_ogg.name
+    voice = update.message.voice
 
-    # Convert OGG to WAV and then to text
-    wav_path = temp_ogg_path.replace(".ogg", ".wav")
-    subprocess.run(["ffmpeg", "-i", temp_ogg_path, wav_path], check=True)
-    text = await speech_to_text_conversion(wav_path)
+    async def produce() -> str:
+        # Download the voice message and transcribe it straight from memory
+        file = await voice.get_file()
+        audio = bytes(await file.download_as_bytearray())
 
-    # Generate response and convert it to speech
+        started = time.perf_counter()
+        text = await transcribe_audio(audio, voice.mime_type)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(
+            f"Transcribed {voice.duration}s of audio in {elapsed_ms:.0f} ms "
+            f"({elapsed_ms / max(voice.duration, 1):.0f} ms per second of audio)"
+        )
+        return text
+
+    text = await get_media_artifact("transcript", voice.file_unique_id, produce)
+
+    # Generate response and send it as speech
     response = await generate_response(user_id, text)
-    audio_path = await text_to_speech_conversion(response)
 
     # Send the response as a voice message
-    await send_voice_message(update, context, audio_path)
+    await send_voice_message(update, context, response)
 
 
-# Send a voice message to the user
-async def send_voice_message(update: Update, context: CallbackContext, audio_path: str):
-    with open(audio_path, "rb") as audio_data:
-        await update.message.reply_voice(voice=audio_data)
+# Cache key for a voice clip: normalized reply text, model and voice
+def tts_cache_key(text: str) -> str:
+    normalized = " ".join(text.lower().split())
+    return hashlib.sha256(f"{TTS_MODEL}|{TTS_VOICE}|{normalized}".encode()).hexdigest()
 
-    # Remove the OGG file after sending
-    if os.path.exists(audio_path):
-        os.remove(audio_path)
+
+def read_tts_cache(key: str) -> Optional[bytes]:
+    path = os.path.join(TTS_CACHE_DIR, f"{key}.ogg")
+    try:
+        with open(path, "rb") as f:
+            audio = f.read()
+    except FileNotFoundError:
+        return None
+    os.utime(path)  # Mark as recently used for LRU eviction
+    return audio
+
+
+def write_tts_cache(key: str, audio: bytes) -> None:
+    path = os.path.join(TTS_CACHE_DIR, f"{key}.ogg")
+    with open(path, "wb") as f:
+        f.write(audio)
+
+    # Evict the least recently used clips once the cache is over its size limit
+    entries = [e for e in os.scandir(TTS_CACHE_DIR) if e.name.endswith(".ogg")]
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+        if total <= TTS_CACHE_MAX_BYTES:
+            break
+        total -= entry.stat().st_size
+        os.remove(entry.path)
+        tts_file_ids.delete(entry.name[: -len(".ogg")])
+
+
+os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+# Telegram file_id of each cached clip, so it is never uploaded twice
+tts_file_ids = ResultCache(
+    MEDIA_INDEX_SIZE, MEDIA_INDEX_TTL, os.path.join(TTS_CACHE_DIR, "file_ids.db")
+)
 
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+# Send a voice reply, from Telegram's copy or the local cache when possible
+async def send_voice_message(update: Update, context: CallbackContext, text: str):
+    if len(text) > TTS_CACHE_MAX_CHARS:
+        audio = await text_to_speech_conversion(text)
+        await update.message.reply_voice(voice=audio)
+    else:
+        key = tts_cache_key(text)
+        file_id = tts_file_ids.get(key)
+        if file_id is not None:
+            try:
+                await update.message.reply_voice(voice=file_id)
+            except BadRequest as e:
+                # Telegram no longer has the file, send our copy instead
+                print(f"Cached voice file rejected, uploading it again: {e}")
+                tts_file_ids.delete(key)
+                file_id = None
+        if file_id is None:
+            audio = await to_thread(read_tts_cache, key)
+            if audio is None:
+                audio = await text_to_speech_conversion(text)
+                await to_thread(write_tts_cache, key, audio)
+            message = await update.message.reply_voice(voice=audio)
+            tts_file_ids.set(key, message.voice.file_id)
+
+    reply_latency = time.time() - update.message.date.timestamp()
+    print(f"Voice reply sent {reply_latency:.1f} s after the user's message")
 
 
 # Function to process photo messages
@@ -810,15 +2347,18 @@ async def process_photo(update: Update, context: CallbackContext):
     print("Processing photo...")
     user_id = update.effective_user.id
     photo = update.message.photo[-1]
-    file = await photo.get_file()
-    file_content = await file.download_as_bytearray()
 
     # Get user's language preference
     user_language = user_languages.get(user_id, "en")
 
     # Open and process the image
-    image = Image.open(io.BytesIO(file_content)).convert("RGB")
-    description = await describe_image(image)
+    async def produce() -> str:
+        file = await photo.get_file()
+        file_content = await file.download_as_bytearray()
+        image = Image.open(io.BytesIO(file_content)).convert("RGB")
+        return await describe_image(image, photo.file_unique_id)
+
+    description = await get_media_artifact("description", photo.file_unique_id, produce)
 
     # Generate a response message
     user_message = (
@@ -843,120 +2383,312 @@ async def process_photo(update: Update, context: CallbackContext):
     await update.message.reply_text(gpt_response)
 
 
-async def describe_image(image: Image.Image) -> str:
-    print("Describing image...")
-    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp_file:
-        image.save(tmp_file, format="JPEG")
-        image_path = tmp_file.name
-
-    base64_image = encode_image(image_path)
+async def describe_image(
+    image: Image.Image, file_unique_id: Optional[str] = None
+) -> str:
+    async def call() -> str:
+        print("Describing image...")
+        base64_image = encode_image_from_pil(image, detail="low")
 
-    response = await client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "user",
-                "content": [
+        response = await call_openai(
+            "vision",
+            lambda: client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
                     {
-                        "type": "text",
-                        "text": "What does this image represent in the context of a dating profile or conversation? Analyze the text, images, or any visible details to identify:\n"
-                        "- Key personality traits, interests, or preferences expressed.\n"
-                        "- The tone or mood conveyed by the profile or conversation.\n"
-                        "- Any specific details that could guide the user in crafting a thoughtful response or message.",
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}",
-                            "detail": "low",
-                        },
-                    },
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": "What does this image represent in the context of a dating profile or conversation? Analyze the text, images, or any visible details to identify:\n"
+                                "- Key personality traits, interests, or preferences expressed.\n"
+                                "- The tone or mood conveyed by the profile or conversation.\n"
+                                "- Any specific details that could guide the user in crafting a thoughtful response or message.",
+                            },
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/jpeg;base64,{base64_image}",
+                                    "detail": "low",
+                                },
+                            },
+                        ],
+                    }
                 ],
-            }
-        ],
-        max_tokens=300,
-    )
+                max_tokens=300,
+            ),
+            tokens=VISION_TOKENS["low"] + 300,
+        )
+
+        return str(response.choices[0])
+
+    return await cached_vision_call("describe", image, call, file_unique_id)
+
 
-    return str(response.choices[0])
+# Describe a frame without letting one user take every vision slot
+async def describe_frame(user_id: int, image: Image.Image) -> str:
+    if user_id not in user_vision_semaphores:
+        user_vision_semaphores[user_id] = Semaphore(VISION_USER_CONCURRENCY)
+    async with user_vision_semaphores[user_id]:
+        async with vision_semaphore:
+            return await describe_image(image)
 
 
-async def extract_frames_from_video(video_path: str, frame_interval: int):
+# Seek for long jumps, grab (decode without retrieving) for short ones
+def seek_frame(cap, current: int, target: int, video_fps: float) -> bool:
+    if target - current > video_fps * 2:
+        return cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+    for _ in range(target - current):
+        if not cap.grab():
+            return False
+    return True
+
+
+def frame_to_image(frame) -> Image.Image:
+    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+def scene_histogram(frame):
+    small = cv2.resize(frame, (64, 64), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    histogram = cv2.calcHist([hsv], [0, 1], None, [16, 16], [0, 180, 0, 256])
+    return cv2.normalize(histogram, histogram)
+
+
+# Decode only the frames we need, runs in a worker thread
+def sample_video_frames(
+    video_path: str,
+    mode: str = FRAME_SAMPLING_MODE,
+    fps: float = FRAME_SAMPLING_FPS,
+    max_frames: int = MAX_SAMPLED_FRAMES,
+    scene_threshold: float = SCENE_CHANGE_THRESHOLD,
+) -> List[Image.Image]:
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         raise ValueError("The video could not be opened.")
 
-    descriptions = []
-    while True:
-        frame_number = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        if frame_number % frame_interval == 0:
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image = Image.fromarray(frame_rgb)
-            description = await describe_image(image)
-            descriptions.append(description)
-
-    cap.release()
-    return descriptions
+    try:
+        video_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total_frames <= 0:
+            return []
+
+        rate = SCENE_ANALYSIS_FPS if mode == "scene" else fps
+        step = max(1, round(video_fps / rate))
+        targets = list(range(0, total_frames, step))
+        if mode == "fps" and len(targets) > max_frames:
+            # Too long for the rate: cover the whole clip with fewer frames instead
+            duration = total_frames / video_fps
+            print(
+                f"Sampling {max_frames} frames over {duration:.0f} s, "
+                f"reduced from {rate} to {max_frames / duration:.2f} fps"
+            )
+            mode = "max_frames"
+        if mode == "max_frames":
+            count = min(max_frames, total_frames)
+            targets = sorted({int(i * total_frames / count) for i in range(count)})
+
+        images = []
+        last_histogram = None
+        position = 0
+        for target in targets:
+            if not seek_frame(cap, position, target, video_fps):
+                break
+            ret, frame = cap.read()
+            if not ret:
+                break
+            position = target + 1
+
+            if mode == "scene":
+                histogram = scene_histogram(frame)
+                if last_histogram is not None and (
+                    cv2.compareHist(
+                        last_histogram, histogram, cv2.HISTCMP_BHATTACHARYYA
+                    )
+                    < scene_threshold
+                ):
+                    continue
+                last_histogram = histogram
+
+            images.append(frame_to_image(frame))
+            if len(images) >= max_frames:
+                break
+        return images
+    finally:
+        cap.release()
+
+
+# Difference hash: 64 bits comparing neighbouring pixels of a 9x8 thumbnail
+def perceptual_hash(image: Image.Image) -> int:
+    thumbnail = image.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = list(thumbnail.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+# Drop frames that look like the last frame we kept
+def dedupe_frames(
+    images: List[Image.Image], threshold: int = FRAME_DEDUP_THRESHOLD
+) -> List[Image.Image]:
+    distinct = []
+    last_hash = None
+    for image in images:
+        frame_hash = perceptual_hash(image)
+        distance = 64 if last_hash is None else bin(frame_hash ^ last_hash).count("1")
+        if distance <= threshold:
+            continue
+        distinct.append(image)
+        last_hash = frame_hash
+    return distinct
+
+
+# Sample and dedupe in one worker call so frames are only pickled once
+def sample_distinct_frames(video_path: str):
+    sampled = sample_video_frames(video_path)
+    images = dedupe_frames(sampled)
+    # Frames are described at low detail, so only that size goes back through the pool
+    for image in images:
+        image.thumbnail(VISION_MAX_SIZE["low"], Image.Resampling.LANCZOS)
+    return len(sampled), images
+
+
+async def extract_frames_from_video(video_path: str, user_id: int):
+    sampled_count, images = await get_running_loop().run_in_executor(
+        video_process_pool, sample_distinct_frames, video_path
+    )
 
+    video_frame_stats["sampled"] += sampled_count
+    video_frame_stats["sent"] += len(images)
+    print(
+        f"Video frames: {sampled_count} sampled, {len(images)} sent "
+        f"(total {video_frame_stats['sampled']} sampled, "
+        f"{video_frame_stats['sent']} sent)"
+    )
 
-async def summarize_descriptions(descriptions: list) -> str:
+    # Describe every frame concurrently, but hand descriptions out in frame order
+    tasks = [create_task(describe_frame(user_id, image)) for image in images]
+    try:
+        for task in tasks:
+            try:
+                yield await task
+            except Exception as e:
+                print(f"Error describing frame: {e}")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def summarize_descriptions(
+    descriptions: list,
+    instruction: str = "Summarize these image descriptions as they are from a video.",
+) -> str:
     combined_descriptions = "\n".join(descriptions)
-    completion = await client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {
-                "role": "system",
-                "content": "Summarize these image descriptions as they are from a video.",
-            },
-            {"role": "user", "content": combined_descriptions},
-        ],
+    completion = await call_openai(
+        "chat",
+        lambda: client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {
+                    "role": "system",
+                    "content": instruction,
+                },
+                {"role": "user", "content": combined_descriptions},
+            ],
+            max_tokens=SUMMARY_MAX_TOKENS,
+        ),
+        tokens=estimate_tokens(combined_descriptions) + SUMMARY_MAX_TOKENS,
     )
     summary_response = completion.choices[0].message.content
     return summary_response
 
 
+# Group texts into consecutive batches that fit in the summary token budget
+def batch_by_tokens(texts: List[str], budget: int = SUMMARY_BATCH_TOKENS):
+    batches = [[]]
+    batch_tokens = 0
+    for text in texts:
+        tokens = len(token_encoding.encode(text))
+        if batches[-1] and batch_tokens + tokens > budget:
+            batches.append([])
+            batch_tokens = 0
+        batches[-1].append(text)
+        batch_tokens += tokens
+    return batches
+
+
+# Merge partial summaries, in several rounds if they don't fit in one call
+async def reduce_summaries(summaries: List[str]) -> str:
+    while len(summaries) > 1:
+        batches = batch_by_tokens(summaries)
+        if len(batches) == len(summaries):
+            batches = [summaries]  # Each summary alone fills the budget
+        merged = await gather(
+            *(
+                summarize_descriptions(
+                    batch,
+                    "Merge these summaries of consecutive parts of a video, "
+                    "in order, into one summary of the whole video.",
+                )
+                for batch in batches
+            ),
+            return_exceptions=True,
+        )
+        # A failed merge keeps its inputs rather than losing them
+        for result in merged:
+            if isinstance(result, Exception):
+                print(f"Error merging video summaries: {result}")
+        summaries = [
+            "\n".join(batch) if isinstance(result, Exception) else result
+            for batch, result in zip(batches, merged)
+        ]
+    return summaries[0]
+
+
 # Function to process video messages and extract information
 async def process_video_message(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    file = await update.message.video.get_file()
-    video_bytearray = await file.download_as_bytearray()
-
-    # Save video to a temporary file
-    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tmp_video_file:
-        tmp_video_file.write(video_bytearray)
-        video_path = tmp_video_file.name
-
-    # Extract audio from the video
-    audio_path = extract_audio(video_path)
-
-    # Transcribe the audio
-    transcript = speech_to_text_conversion(audio_path)
-
-    # Extract frames and describe them
-    fps = int(cv2.VideoCapture(video_path).get(cv2.CAP_PROP_FPS))
-    frame_interval = fps
-    try:
-        descriptions = await extract_frames_from_video(video_path, frame_interval)
-    except ValueError as e:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text=str(e))
-        os.remove(video_path)
-        os.remove(audio_path)
-        return
+    video = update.message.video
+
+    # Reuse the analysis of a video that was already processed
+    summary = media_index.get(f"frame_summary:{video.file_unique_id}")
+    transcript = media_index.get(f"transcript:{video.file_unique_id}")
+    media_index.record(summary is not None and transcript is not None)
+
+    if summary is None or transcript is None:
+        file = await video.get_file()
+        video_bytearray = await file.download_as_bytearray()
+
+        # Save video to a temporary file
+        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tmp_video_file:
+            tmp_video_file.write(video_bytearray)
+            video_path = tmp_video_file.name
+
+        # Analyze the audio track and the frames at the same time
+        try:
+            transcript, summary = await gather(
+                transcribe_video_audio(video_path),
+                summarize_video_frames(video_path, user_id),
+                return_exceptions=True,
+            )
+        finally:
+            os.remove(video_path)
 
-    if not descriptions:
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="No frames could be extracted from the video.",
-        )
-        os.remove(video_path)
-        os.remove(audio_path)
-        return
+        for result in (transcript, summary):
+            if isinstance(result, ValueError):
+                await context.bot.send_message(
+                    chat_id=update.effective_chat.id, text=str(result)
+                )
+                return
+            if isinstance(result, BaseException):
+                raise result
 
-    # Summarize the descriptions
-    summary = await summarize_descriptions(descriptions)
+        media_index.set(f"frame_summary:{video.file_unique_id}", summary)
+        media_index.set(f"transcript:{video.file_unique_id}", transcript)
 
     # Create a response
     response_text = f"""The user has sent you a video. Act as if you can actually see and hear the content:
@@ -970,20 +2702,62 @@ async def process_video_message(update: Update, context: CallbackContext):
     # Generate a response from GPT
     gpt_response = await generate_response(user_id, response_text)
 
-    audio_path = await text_to_speech_conversion(gpt_response)
-
     # Send the response as a voice message
-    await send_voice_message(update, context, audio_path)
-
-    # Clean up temporary files
-    os.remove(video_path)
-
-
-def extract_audio(video_path):
-    video_clip = VideoFileClip(video_path)
-    audio_path = video_path.replace(".mp4", ".wav")
-    video_clip.audio.write_audiofile(audio_path)
-    return audio_path
+    await send_voice_message(update, context, gpt_response)
+
+
+async def transcribe_video_audio(video_path: str) -> str:
+    audio = await extract_audio(video_path)
+    if audio is None:
+        return "(the video has no sound)"
+    return await speech_to_text_conversion(audio, "audio.ogg")
+
+
+# Summarize batches of frames as soon as they are described, then merge them
+async def summarize_video_frames(video_path: str, user_id: int) -> str:
+    partial_tasks = []
+    batch = []
+    batch_tokens = 0
+    async for description in extract_frames_from_video(video_path, user_id):
+        tokens = len(token_encoding.encode(description))
+        if batch and batch_tokens + tokens > SUMMARY_BATCH_TOKENS:
+            partial_tasks.append(create_task(summarize_descriptions(batch)))
+            batch = []
+            batch_tokens = 0
+        batch.append(description)
+        batch_tokens += tokens
+    if batch:
+        partial_tasks.append(create_task(summarize_descriptions(batch)))
+    if not partial_tasks:
+        raise ValueError("No frames could be extracted from the video.")
+
+    # Batches whose summary failed are skipped, the others are still merged
+    partials = []
+    for result in await gather(*partial_tasks, return_exceptions=True):
+        if isinstance(result, Exception):
+            print(f"Error summarizing video frames: {result}")
+        else:
+            partials.append(result)
+    if not partials:
+        raise ValueError("The video could not be summarized.")
+    return await reduce_summaries(partials)
+
+
+# Demux the audio track straight into compact speech audio, None if there is none
+async def extract_audio(video_path: str) -> Optional[bytes]:
+    streams = await run_ffmpeg(
+        "ffprobe",
+        "-select_streams",
+        "a",
+        "-show_entries",
+        "stream=index",
+        "-of",
+        "csv=p=0",
+        video_path,
+    )
+    if not streams.strip():
+        return None
+    return await run_ffmpeg("ffmpeg", "-i", video_path, *FFMPEG_SPEECH_OUTPUT)
 
 
 def create_checkout_session(user_id: str, success_url: str, cancel_url: str):
@@ -1060,7 +2834,9 @@ async def error_handler(update: Update, context: CallbackContext) -> None:
 # Modify main() to include error handler
 def main() -> None:
     print("Building application...")
-    application = ApplicationBuilder().token(telegram_api_key).build()
+    application = (
+        ApplicationBuilder().token(telegram_api_key).post_init(start_scheduler).build()
+    )
 
     print("Adding handlers...")
     application.add_handler(CommandHandler("start", start))
@@ -1068,15 +2844,27 @@ def main() -> None:
     application.add_handler(
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
     )
-    application.add_handler(MessageHandler(filters.VOICE, process_voice_message))
-    application.add_handler(MessageHandler(filters.PHOTO, process_photo))
-    application.add_handler(MessageHandler(filters.VIDEO, process_video_message))
+    application.add_handler(
+        MessageHandler(filters.VOICE, serialized(process_voice_message, PRIORITY_MEDIA))
+    )
+    application.add_handler(
+        MessageHandler(filters.PHOTO & MediaGroupFilter(), collect_album_photo)
+    )
+    application.add_handler(
+        MessageHandler(
+            filters.PHOTO & filters.Caption(["learn"]),
+            serialized(process_conversation, PRIORITY_MEDIA),
+        )
+    )
+    application.add_handler(
+        MessageHandler(filters.PHOTO, serialized(process_photo, PRIORITY_MEDIA))
+    )
+    application.add_handler(
+        MessageHandler(filters.VIDEO, serialized(process_video_message, PRIORITY_VIDEO))
+    )
     application.add_handler(CommandHandler("settings", settings))
     application.add_handler(CallbackQueryHandler(config_callback, pattern="^config_"))
     application.add_handler(CallbackQueryHandler(set_config_callback, pattern="^set_"))
-    application.add_handler(
-        MessageHandler(filters.PHOTO & filters.Caption("learn"), process_conversation)
-    )
 
     # Add error handler
     application.add_error_handler(error_handler)
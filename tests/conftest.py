@@ -0,0 +1,17 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Import the bot offline, with its databases and indexes in a temp dir
+@pytest.fixture(scope="session")
+def bot(tmp_path_factory):
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    os.environ["EMBEDDINGS_PROVIDER"] = "fake"
+    os.chdir(tmp_path_factory.mktemp("bot"))
+    sys.path.insert(0, REPO_DIR)
+    return importlib.import_module("bot")
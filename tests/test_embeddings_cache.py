@@ -0,0 +1,58 @@
+import hashlib
+import sqlite3
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+
+def cached_texts(embeddings, texts):
+    keys = {embeddings.key(text): text for text in texts}
+    rows = embeddings.connection.execute("SELECT key FROM embeddings").fetchall()
+    return {keys[key] for key, in rows if key in keys}
+
+
+def make_embeddings(bot, tmp_path, max_rows=3):
+    return bot.CachedBatchEmbeddings(
+        DeterministicFakeEmbedding(size=8),
+        "fake",
+        str(tmp_path / "embeddings.db"),
+        max_rows=max_rows,
+    )
+
+
+# Queries are embedded but only documents are written to disk
+def test_queries_are_not_stored(bot, tmp_path):
+    embeddings = make_embeddings(bot, tmp_path)
+    embeddings.embed_query("she said maybe")
+    embeddings.embed_documents(["haha ok see u tmrw"])
+    assert cached_texts(embeddings, ["she said maybe", "haha ok see u tmrw"]) == {
+        "haha ok see u tmrw"
+    }
+
+
+# Past the row cap, the least recently used vectors are dropped
+def test_least_recently_used_rows_are_evicted(bot, tmp_path):
+    embeddings = make_embeddings(bot, tmp_path)
+    for text in ["a", "b", "c"]:
+        embeddings.embed_documents([text])
+    embeddings.embed_documents(["a"])  # A cache hit makes "a" the most recent
+    embeddings.embed_documents(["d"])
+    assert cached_texts(embeddings, "abcd") == {"a", "c", "d"}
+
+
+# Caches written before the cap existed are upgraded in place
+def test_old_cache_keeps_its_vectors(bot, tmp_path):
+    connection = sqlite3.connect(tmp_path / "embeddings.db")
+    connection.execute(
+        "CREATE TABLE embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+    )
+    key = hashlib.sha256(b"fake|old").hexdigest()
+    vector = np.ones(8, dtype=np.float16)
+    connection.execute("INSERT INTO embeddings VALUES (?, ?)", (key, vector.tobytes()))
+    connection.commit()
+    connection.close()
+
+    embeddings = make_embeddings(bot, tmp_path)
+    embeddings.embed_documents(["a"])
+    assert cached_texts(embeddings, ["old", "a"]) == {"old", "a"}
+    assert embeddings.embed_documents(["old"]) == [[1.0] * 8]
@@ -0,0 +1,39 @@
+import asyncio
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+
+def conversation():
+    return [
+        HumanMessage(content="we matched last week on the app"),
+        AIMessage(content="nice, what did you talk about so far"),
+        HumanMessage(content="mostly climbing and her dog Biscuit"),
+        AIMessage(content="ask her to the climbing gym this weekend"),
+        HumanMessage(content="she said maybe, what now?"),
+    ]
+
+
+# The summary outlives the session's eviction from RAM and no task is left behind
+def test_summary_survives_session_eviction(bot, monkeypatch):
+    async def call_openai(endpoint, call, tokens=0):
+        return SimpleNamespace(content="They bonded over climbing and her dog.")
+
+    monkeypatch.setattr(bot, "call_openai", call_openai)
+    monkeypatch.setattr(bot, "HISTORY_TOKEN_BUDGET", 10)
+    config = {"configurable": {"session_id": "summary-test"}}
+
+    async def run():
+        await bot.compact_history(conversation(), config)
+        await bot.summary_tasks["summary-test"]
+        await asyncio.sleep(0)  # Let the done callback run
+        assert "summary-test" not in bot.summary_tasks
+
+        bot.store.clear()
+        return await bot.compact_history(conversation(), config)
+
+    kept = asyncio.run(run())
+
+    assert isinstance(kept[0], SystemMessage)
+    assert "climbing and her dog" in kept[0].content
+    assert kept[1:] == conversation()[-1:]
@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessageChunk
+from telegram.error import BadRequest, RetryAfter
+
+
+class FakeChain:
+    def __init__(self, words):
+        self.words = words
+
+    async def astream(self, messages, config=None):
+        for word in self.words:
+            yield AIMessageChunk(content=word)
+
+
+class FakeMessage:
+    def __init__(self, sent, edit_error=None):
+        self.sent = sent
+        self.edit_error = edit_error
+
+    async def reply_text(self, text, **kwargs):
+        self.sent.append(("send", text))
+        return FakeMessage(self.sent, self.edit_error)
+
+    async def edit_text(self, text, **kwargs):
+        if self.edit_error is not None:
+            raise self.edit_error
+        self.sent.append(("edit", text))
+
+
+async def no_chat_action(chat_id, action):
+    pass
+
+
+def make_update(sent, edit_error=None):
+    message = FakeMessage(sent, edit_error)
+    message.from_user = SimpleNamespace(id=42)
+    return SimpleNamespace(message=message, effective_chat=SimpleNamespace(id=42))
+
+
+def make_context():
+    return SimpleNamespace(
+        bot=SimpleNamespace(send_chat_action=no_chat_action), user_data={}
+    )
+
+
+# Flood control on the intermediate edits must not end the stream
+def test_stream_survives_failing_edits(bot, monkeypatch):
+    monkeypatch.setattr(bot, "STREAM_EDIT_INTERVAL", 0)
+    monkeypatch.setattr(bot, "chain_with_history", FakeChain(["hey", " there", "!"]))
+    sent = []
+    update = make_update(sent, edit_error=RetryAfter(1))
+
+    text, reply, shown = asyncio.run(
+        bot.stream_reply(update, make_context(), [], {"configurable": {}})
+    )
+
+    assert text == "hey there!"
+    assert reply is not None
+    assert shown == "hey"
+    assert sent == [("send", "hey")]
+
+
+def answer_with_stream_result(bot, monkeypatch, edit_error):
+    sent = []
+    partial = FakeMessage(sent, edit_error)
+
+    async def stream_reply(update, context, messages, config):
+        return "hey there!", partial, "hey"
+
+    monkeypatch.setattr(bot, "stream_reply", stream_reply)
+    asyncio.run(
+        bot.answer_messages(make_update(sent), make_context(), "she said maybe")
+    )
+    return sent
+
+
+# A failed final edit falls back to sending the full reply
+def test_final_edit_failure_sends_the_reply(bot, monkeypatch):
+    sent = answer_with_stream_result(bot, monkeypatch, BadRequest("Chat not found"))
+    assert sent == [("send", "hey there!")]
+
+
+# An edit Telegram sees as unchanged is not sent twice
+def test_final_edit_not_modified_is_ignored(bot, monkeypatch):
+    sent = answer_with_stream_result(
+        bot, monkeypatch, BadRequest("Message is not modified")
+    )
+    assert sent == []
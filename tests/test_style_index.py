@@ -0,0 +1,58 @@
+import os
+import shutil
+
+import pytest
+from langchain_community.vectorstores import FAISS
+
+
+@pytest.fixture
+def index(bot):
+    return FAISS.from_texts(["haha ok see u tmrw"], bot.embeddings)
+
+
+def load(bot, path):
+    return FAISS.load_local(path, bot.embeddings, allow_dangerous_deserialization=True)
+
+
+# Crash after the old index was moved aside: the finished new one is used
+def test_recovers_new_index_after_old_was_moved_aside(bot, index):
+    path = bot.style_index_path(1)
+    index.save_local(f"{path}.old")
+    newer = FAISS.from_texts(["new screenshot"], bot.embeddings)
+    newer.save_local(f"{path}.tmp")
+
+    bot.recover_style_index(path)
+
+    assert not os.path.exists(f"{path}.old")
+    assert not os.path.exists(f"{path}.tmp")
+    assert len(load(bot, path).index_to_docstore_id) == 1
+    assert load(bot, path).similarity_search("new screenshot", k=1)[0].page_content == (
+        "new screenshot"
+    )
+
+
+# Only the moved-aside index is left: it is put back
+def test_restores_old_index_when_nothing_else_is_left(bot, index):
+    path = bot.style_index_path(2)
+    index.save_local(f"{path}.old")
+
+    bot.recover_style_index(path)
+
+    assert not os.path.exists(f"{path}.old")
+    assert len(load(bot, path).index_to_docstore_id) == 1
+
+
+# Crash after the swap, before the previous index was removed: saving still works
+def test_save_succeeds_after_stale_old_index(bot, index):
+    user_id = 3
+    path = bot.style_index_path(user_id)
+    bot.save_style_index(user_id, index)
+    shutil.copytree(path, f"{path}.old")
+
+    index.add_texts(["second screenshot"])
+    bot.save_style_index(user_id, index)
+    bot.save_style_index(user_id, index)
+
+    assert not os.path.exists(f"{path}.old")
+    assert not os.path.exists(f"{path}.tmp")
+    assert len(load(bot, path).index_to_docstore_id) == 2
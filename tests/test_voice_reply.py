@@ -0,0 +1,40 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+CLIP = b"OggS" + bytes(100)
+
+
+class FakeMessage:
+    def __init__(self, sent):
+        self.sent = sent
+        self.date = datetime.now(timezone.utc)
+
+    # Telegram rejects file_ids it no longer knows, uploads get a new one
+    async def reply_voice(self, voice, **kwargs):
+        if isinstance(voice, str):
+            raise BadRequest("Wrong file identifier/http url specified")
+        self.sent.append(voice)
+        return SimpleNamespace(voice=SimpleNamespace(file_id="fresh-file-id"))
+
+
+# A stale file_id falls back to the local clip and is replaced by the new one
+def test_rejected_file_id_falls_back_to_the_local_clip(bot, monkeypatch):
+    async def text_to_speech_conversion(text):
+        raise AssertionError("the cached clip should be used")
+
+    monkeypatch.setattr(bot, "text_to_speech_conversion", text_to_speech_conversion)
+    text = "no pressure, maybe works!"
+    key = bot.tts_cache_key(text)
+    bot.write_tts_cache(key, CLIP)
+    bot.tts_file_ids.set(key, "stale-file-id")
+    sent = []
+
+    asyncio.run(
+        bot.send_voice_message(SimpleNamespace(message=FakeMessage(sent)), None, text)
+    )
+
+    assert sent == [CLIP]
+    assert bot.tts_file_ids.get(key) == "fresh-file-id"